@@ -0,0 +1,32 @@
+"""
+Measure the per-check cost of the rate limiter modes.
+
+Usage: python benchmarks/rate_limiter.py [checks] [users]
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from handlers.rate_limiter import RATE_LIMITER_MODES, create_rate_limiter
+
+def bench(mode, checks, user_count):
+    # Generous limits so every check takes the full allowed path
+    limiter = create_rate_limiter(mode, messages_per_minute=10**9, burst_limit=10**9, cooldown_seconds=60)
+    user_ids = [f"user{i}" for i in range(user_count)]
+
+    start = time.perf_counter()
+    for i in range(checks):
+        limiter.is_allowed(user_ids[i % user_count])
+    elapsed = time.perf_counter() - start
+    return elapsed / checks * 1e9
+
+def main():
+    checks = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    user_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    print(f"{checks} checks across {user_count} users")
+    for mode in RATE_LIMITER_MODES:
+        print(f"  {mode:<10} {bench(mode, checks, user_count):8.1f} ns/check")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,191 @@
-import json, os
+import json, os, threading
+from . import message_store, message_cache, permissions
 
 _MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 channels_db_dir = os.path.join(_MODULE_DIR, "channels")
 channels_index = os.path.join(_MODULE_DIR, "channels.json")
 
+def _load_messages_config():
+    """Load the DB.messages section of config.json, if there is one."""
+    try:
+        with open(os.path.join(_MODULE_DIR, "..", "config.json"), "r") as f:
+            return json.load(f).get("DB", {}).get("messages", {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+_messages_config = _load_messages_config()
+_store = message_store.create_store(_messages_config.get("engine", "log"), channels_db_dir)
+_cache = message_cache.HotTailCache(_messages_config.get("hot_cache_size", 200))
+_permissions = permissions.PermissionMatrix(channels_index)
+
+# Called with the channel name after this process writes to a channel
+_write_listeners = []
+
+# One writer at a time per channel. Reads answered by the hot tail cache take no
+# lock, since the cache publishes immutable snapshots; reads that go to the store
+# take their own channel's lock, so they never wait on writes to other channels.
+_channel_locks = {}
+_channel_locks_guard = threading.Lock()
+# Shared by channels that are not declared in channels.json
+_undeclared_lock = threading.RLock()
+
+# Serializes read-modify-write cycles of channels.json
+_index_lock = threading.RLock()
+
+def _channel_lock(channel_name):
+    """
+    Get the lock of a channel. Only channels declared in channels.json get their own
+    lock, so client-supplied names never add locks.
+    """
+    lock = _channel_locks.get(channel_name)
+    if lock is None:
+        if not _permissions.is_declared(channel_name):
+            return _undeclared_lock
+        with _channel_locks_guard:
+            lock = _channel_locks.setdefault(channel_name, threading.RLock())
+    return lock
+
+def _is_text_channel(channel_name):
+    """
+    Check that a channel name is safe to use as a file name and not declared in channels.json
+    as anything but a text channel. Client-supplied names must pass this before they reach the store.
+    """
+    if not message_store.is_safe_channel_name(channel_name):
+        return False
+    return _permissions.is_text_channel(channel_name) or not _permissions.is_declared(channel_name)
+
+def _write_index(channels):
+    """Replace channels.json in one step, so lock-free readers never see a partial file."""
+    tmp_path = channels_index + f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(channels, f, indent=4)
+    os.replace(tmp_path, channels_index)
+    _permissions.invalidate()
+
+def _on_foreign_record(channel_name, record):
+    """Fold a record written by another server process into the hot tail cache."""
+    if record.get("op") == message_store.OP_NEW:
+        _cache.append(channel_name, record.get("msg", {}))
+    else:
+        _cache.apply(channel_name, record)
+
+def _on_write(channel_name):
+    for listener in _write_listeners:
+        listener(channel_name)
+
+def _attach_store(store):
+    store.record_listeners.append(_on_foreign_record)
+    store.write_listeners.append(_on_write)
+
+_attach_store(_store)
+
+def set_message_store(store):
+    """
+    Replace the storage engine used for channel messages.
+
+    Args:
+        store (message_store.MessageStore): The storage engine to use.
+    """
+    global _store
+    _attach_store(store)
+    _store = store
+    _cache.clear()
+
+def set_shared_storage(shared=True):
+    """
+    Tell the storage engine whether other server processes write to the same channel files.
+
+    Raises:
+        ValueError: If the storage engine cannot be shared.
+    """
+    if shared and not _store.supports_shared:
+        raise ValueError("The configured message storage engine cannot be shared between processes")
+    _store.shared = shared
+
+def add_write_listener(listener):
+    """
+    Register a function called with the channel name after every message write made by this process.
+    """
+    _write_listeners.append(listener)
+
+def sync_channel(channel_name):
+    """
+    Pick up messages written to a channel by other server processes and update the cache.
+    """
+    if not _is_text_channel(channel_name):
+        return
+    with _channel_lock(channel_name):
+        _store.sync(channel_name)
+
+def compact_channels():
+    """
+    Compact the message files of every text channel that has grown mostly dead.
+
+    Returns:
+        int: The number of channels compacted.
+    """
+    compacted = 0
+    for channel in get_channels():
+        if not _is_text_channel(channel.get("name")):
+            continue
+        with _channel_lock(channel.get("name")):
+            if _store.compact_if_needed(channel.get("name")):
+                compacted += 1
+    return compacted
+
+def get_message_store():
+    """
+    Get the storage engine used for channel messages.
+    """
+    return _store
+
+def warm_cache():
+    """
+    Load the most recent messages of every text channel into the hot tail cache.
+    """
+    for channel in get_channels():
+        if _is_text_channel(channel.get("name")):
+            with _channel_lock(channel.get("name")):
+                _store.prepare(channel.get("name"))
+                _fill_cache(channel.get("name"), _cache.size)
+
+def _fill_cache(channel_name, limit):
+    """
+    Read the last messages of a channel through the store and cache them.
+    Must be called with the channel's lock held.
+
+    Returns:
+        list: The last 'limit' messages, or None if the channel has no message data.
+    """
+    wanted = max(limit, _cache.size)
+    channel_data = _store.read_tail(channel_name, wanted) if wanted > 0 else None
+    if channel_data is None:
+        return None
+    _cache.fill(channel_name, channel_data, complete=len(channel_data) < wanted)
+    return channel_data[-limit:]
+
+def invalidate_permissions():
+    """
+    Drop the compiled permission matrix after channels.json has changed.
+    """
+    _permissions.invalidate()
+
+def get_permissions_version():
+    """
+    Get a counter that changes every time channel permissions may have changed.
+    """
+    return _permissions.version
+
+def get_cache_stats():
+    """
+    Get the hot tail cache hit/miss counters.
+
+    Returns:
+        dict: The counters and the number of cached channels and messages.
+    """
+    return _cache.stats()
+
 def get_channel(channel_name):
     """
     Get channel data by channel name.
@@ -26,11 +207,18 @@ def get_channel_messages(channel_name, limit=100):
     Returns:
         list: A list of messages from the specified channel.
     """
-    # Load the channel data
-    try:
-        with open(f"{channels_db_dir}/{channel_name}.json", 'r', encoding='utf-8') as f:
-            channel_data = json.load(f)
-    except FileNotFoundError:
+    if not _is_text_channel(channel_name):
+        return []
+    cached = _cache.tail(channel_name, limit)
+    if cached is not None:
+        return cached
+
+    with _channel_lock(channel_name):
+        if isinstance(limit, int) and limit > 0:
+            return _fill_cache(channel_name, limit) or []
+
+        channel_data = _store.read(channel_name)
+    if channel_data is None:
         return []
 
     # Return the last 'limit' messages
@@ -47,23 +235,11 @@ def save_channel_message(channel_name, message):
     Returns:
         bool: True if the message was saved successfully, False otherwise.
     """
-    # Ensure the channels directory exists
-    os.makedirs(channels_db_dir, exist_ok=True)
-    
-    # Load existing channel data or create a new one
-    try:
-        with open(f"{channels_db_dir}/{channel_name}.json", 'r', encoding='utf-8') as f:
-            channel_data = json.load(f)
-    except FileNotFoundError:
-        channel_data = []
-
-    # Append the new message
-    channel_data.append(message)
-
-    # Save the updated channel data with compact formatting
-    with open(f"{channels_db_dir}/{channel_name}.json", 'w', encoding='utf-8') as f:
-        json.dump(channel_data, f, separators=(',', ':'), ensure_ascii=False)
-
+    if not _is_text_channel(channel_name):
+        return False
+    with _channel_lock(channel_name):
+        _store.append(channel_name, message)
+        _cache.append(channel_name, message)
     return True
 
 def get_all_channels_for_roles(roles):
@@ -76,18 +252,7 @@ def get_all_channels_for_roles(roles):
     Returns:
         list: A list of channel info dicts available for the specified roles.
     """
-    channels = []
-    try:
-        with open(channels_index, 'r', encoding='utf-8') as f:
-            all_channels = json.load(f)
-        for channel in all_channels:
-            permissions = channel.get("permissions", {})
-            view_roles = permissions.get("view", [])
-            if any(role in view_roles for role in roles):
-                channels.append(channel)
-    except FileNotFoundError:
-        return []
-    return channels
+    return _permissions.channels_for_roles(roles)
 
 def edit_channel_message(channel_name, message_id, new_content):
     """
@@ -101,27 +266,13 @@ def edit_channel_message(channel_name, message_id, new_content):
     Returns:
         bool: True if the message was edited successfully, False otherwise.
     """
-    try:
-        with open(f"{channels_db_dir}/{channel_name}.json", 'r', encoding='utf-8') as f:
-            channel_data = json.load(f)
-
-        for msg in channel_data:
-            if msg.get("id") == message_id:
-                msg["content"] = new_content
-                msg["edited"] = True
-                break
-        else:
-            return False  # Message not found
-
-        # Ensure the channels directory exists
-        os.makedirs(channels_db_dir, exist_ok=True)
-        
-        with open(f"{channels_db_dir}/{channel_name}.json", 'w', encoding='utf-8') as f:
-            json.dump(channel_data, f, separators=(',', ':'), ensure_ascii=False)
-
-        return True
-    except FileNotFoundError:
+    if not _is_text_channel(channel_name):
         return False
+    with _channel_lock(channel_name):
+        if not _store.edit(channel_name, message_id, new_content):
+            return False
+        _cache.apply(channel_name, {"op": message_store.OP_EDIT, "id": message_id, "content": new_content})
+    return True
 
 def get_channel_message(channel_name, message_id):
     """
@@ -134,16 +285,14 @@ def get_channel_message(channel_name, message_id):
     Returns:
         dict: The message if found, None otherwise.
     """
-    try:
-        with open(f"{channels_db_dir}/{channel_name}.json", 'r', encoding='utf-8') as f:
-            channel_data = json.load(f)
+    if not _is_text_channel(channel_name):
+        return None
+    cached, msg = _cache.find(channel_name, message_id)
+    if cached:
+        return msg
 
-        for msg in channel_data:
-            if msg.get("id") == message_id:
-                return msg
-        return None  # Message not found
-    except FileNotFoundError:
-        return None  # Channel not found
+    with _channel_lock(channel_name):
+        return _store.get(channel_name, message_id)
     
 def does_user_have_permission(channel_name, user_roles, permission_type):
     """
@@ -157,19 +306,7 @@ def does_user_have_permission(channel_name, user_roles, permission_type):
     Returns:
         bool: True if the user has the required permission, False otherwise.
     """
-    try:
-        with open(channels_index, 'r', encoding='utf-8') as f:
-            channels_data = json.load(f)
-
-        for channel in channels_data:
-            if channel.get("name") == channel_name:
-                permissions = channel.get("permissions", {})
-                allowed_roles = permissions.get(permission_type, [])
-                return any(role in allowed_roles for role in user_roles)
-    except FileNotFoundError:
-        return False  # Channel index not found
-
-    return False  # Channel not found
+    return _permissions.has(channel_name, user_roles, permission_type)
     
 def delete_channel_message(channel_name, message_id):
     """
@@ -182,21 +319,13 @@ def delete_channel_message(channel_name, message_id):
     Returns:
         bool: True if the message was deleted successfully, False otherwise.
     """
-    try:
-        with open(f"{channels_db_dir}/{channel_name}.json", 'r', encoding='utf-8') as f:
-            channel_data = json.load(f)
-
-        new_data = [msg for msg in channel_data if msg.get("id") != message_id]
-
-        # Ensure the channels directory exists
-        os.makedirs(channels_db_dir, exist_ok=True)
-        
-        with open(f"{channels_db_dir}/{channel_name}.json", 'w', encoding='utf-8') as f:
-            json.dump(new_data, f, separators=(',', ':'), ensure_ascii=False)
-
-        return True
-    except FileNotFoundError:
+    if not _is_text_channel(channel_name):
         return False
+    with _channel_lock(channel_name):
+        if not _store.delete(channel_name, message_id):
+            return False
+        _cache.apply(channel_name, {"op": message_store.OP_DELETE, "id": message_id})
+    return True
     
 def get_channels():
     """
@@ -222,30 +351,30 @@ def create_channel(channel_name, channel_type):
     Returns:
         bool: True if the channel was created successfully, False if it already exists.
     """
-    try:
-        with open(channels_index, 'r', encoding='utf-8') as f:
-            channels = json.load(f)
-    except FileNotFoundError:
-        channels = []
-
-    # Check if the channel already exists
-    if any(channel.get('name') == channel_name for channel in channels):
-        return False  # Channel already exists
-
-    new_channel = {
-        "name": channel_name,
-        "type": channel_type,
-        "permissions": {
-            "view": ["owner"],
-            "send": ["owner"]
+    with _index_lock:
+        try:
+            with open(channels_index, 'r', encoding='utf-8') as f:
+                channels = json.load(f)
+        except FileNotFoundError:
+            channels = []
+
+        # Check if the channel already exists
+        if any(channel.get('name') == channel_name for channel in channels):
+            return False  # Channel already exists
+
+        new_channel = {
+            "name": channel_name,
+            "type": channel_type,
+            "permissions": {
+                "view": ["owner"],
+                "send": ["owner"]
+            }
         }
-    }
 
-    channels.append(new_channel)
+        channels.append(new_channel)
 
-    # Save the updated channels index
-    with open(channels_index, 'w', encoding='utf-8') as f:
-        json.dump(channels, f, indent=4)
+        # Save the updated channels index
+        _write_index(channels)
 
     return True
 
@@ -260,20 +389,28 @@ def delete_channel(channel_name):
         bool: True if the channel was deleted successfully, False if it does not exist.
     """
     try:
-        with open(channels_index, 'r', encoding='utf-8') as f:
-            channels = json.load(f)
+        with _index_lock:
+            with open(channels_index, 'r', encoding='utf-8') as f:
+                channels = json.load(f)
 
-        new_channels = [channel for channel in channels if channel.get('name') != channel_name]
+            new_channels = [channel for channel in channels if channel.get('name') != channel_name]
 
-        if len(new_channels) == len(channels):
-            return False  # Channel not found
+            if len(new_channels) == len(channels):
+                return False  # Channel not found
 
-        # Save the updated channels index
-        with open(channels_index, 'w', encoding='utf-8') as f:
-            json.dump(new_channels, f, indent=4)
+            # Save the updated channels index
+            _write_index(new_channels)
 
-        # Remove the channel's message file
-        os.remove(f"{channels_db_dir}/{channel_name}.json")
+        # Remove the channel's message data
+        if not message_store.is_safe_channel_name(channel_name):
+            return True
+        try:
+            with _channel_lock(channel_name):
+                _cache.drop(channel_name)
+                _store.drop(channel_name)
+        finally:
+            with _channel_locks_guard:
+                _channel_locks.pop(channel_name, None)
 
         return True
     except FileNotFoundError:
@@ -292,27 +429,27 @@ def set_channel_permissions(channel_name, role, permission, allow=True):
         bool: True if permissions were set successfully, False if the channel does not exist.
     """
     try:
-        with open(channels_index, 'r', encoding='utf-8') as f:
-            channels = json.load(f)
-
-        for channel in channels:
-            if channel.get('name') == channel_name:
-                if permission not in channel['permissions']:
-                    channel['permissions'][permission] = []
-                if role not in channel['permissions'][permission]:
-                    if allow:
-                        channel['permissions'][permission].append(role)
-                    else:                        # If removing permission, ensure the role exists before removing
-                        if role in channel['permissions'][permission]:
-                            channel['permissions'][permission].remove(role)
-                
-                # Save the updated channels index
-                with open(channels_index, 'w', encoding='utf-8') as f:
-                    json.dump(channels, f, indent=4)
-                
-                return True
-        
-        return False  # Channel not found
+        with _index_lock:
+            with open(channels_index, 'r', encoding='utf-8') as f:
+                channels = json.load(f)
+
+            for channel in channels:
+                if channel.get('name') == channel_name:
+                    if permission not in channel['permissions']:
+                        channel['permissions'][permission] = []
+                    if role not in channel['permissions'][permission]:
+                        if allow:
+                            channel['permissions'][permission].append(role)
+                        else:                        # If removing permission, ensure the role exists before removing
+                            if role in channel['permissions'][permission]:
+                                channel['permissions'][permission].remove(role)
+                    
+                    # Save the updated channels index
+                    _write_index(channels)
+                    
+                    return True
+            
+            return False  # Channel not found
     except FileNotFoundError:
         return False  # Channels index not found
     
@@ -350,23 +487,23 @@ def reorder_channel(channel_name, new_position):
         bool: True if the channel was reordered successfully, False if it does not exist.
     """
     try:
-        with open(channels_index, 'r', encoding='utf-8') as f:
-            channels = json.load(f)
-
-        for i, channel in enumerate(channels):
-            if channel.get('name') == channel_name:
-                # Remove the channel from its current position
-                channels.pop(i)
-                # Insert it at the new position
-                channels.insert(int(new_position), channel)
-
-                # Save the updated channels index
-                with open(channels_index, 'w', encoding='utf-8') as f:
-                    json.dump(channels, f, indent=4)
-                
-                return True
-        
-        return False  # Channel not found
+        with _index_lock:
+            with open(channels_index, 'r', encoding='utf-8') as f:
+                channels = json.load(f)
+
+            for i, channel in enumerate(channels):
+                if channel.get('name') == channel_name:
+                    # Remove the channel from its current position
+                    channels.pop(i)
+                    # Insert it at the new position
+                    channels.insert(int(new_position), channel)
+
+                    # Save the updated channels index
+                    _write_index(channels)
+                    
+                    return True
+            
+            return False  # Channel not found
     except FileNotFoundError:
         return False  # Channels index not found
 
@@ -382,20 +519,25 @@ def get_message_replies(channel_name, message_id, limit=50):
     Returns:
         list: A list of messages that are replies to the specified message.
     """
-    try:
-        with open(f"{channels_db_dir}/{channel_name}.json", 'r', encoding='utf-8') as f:
-            channel_data = json.load(f)
-
-        replies = []
-        for msg in channel_data:
-            if msg.get("reply_to", {}).get("id") == message_id:
-                replies.append(msg)
-                if len(replies) >= limit:
-                    break
-        
-        return replies
-    except FileNotFoundError:
+    if not _is_text_channel(channel_name):
+        return []
+    cached = _cache.replies(channel_name, message_id, limit)
+    if cached is not None:
+        return cached
+
+    with _channel_lock(channel_name):
+        channel_data = _store.read(channel_name)
+    if channel_data is None:
         return []  # Channel not found
+
+    replies = []
+    for msg in channel_data:
+        if msg.get("reply_to", {}).get("id") == message_id:
+            replies.append(msg)
+            if len(replies) >= limit:
+                break
+
+    return replies
     
 def purge_messages(channel_name, count):
     """
@@ -408,138 +550,76 @@ def purge_messages(channel_name, count):
     Returns:
         bool: True if messages were purged successfully, False if the channel does not exist or has fewer messages.
     """
-    try:
-        with open(f"{channels_db_dir}/{channel_name}.json", 'r', encoding='utf-8') as f:
-            channel_data = json.load(f)
-
-        if len(channel_data) < count:
-            return False  # Not enough messages to purge
-
-        # Remove the last 'count' messages
-        new_data = channel_data[:-count]
-
-        # Save the updated channel data
-        with open(f"{channels_db_dir}/{channel_name}.json", 'w', encoding='utf-8') as f:
-            json.dump(new_data, f, separators=(',', ':'), ensure_ascii=False)
-
-        return True
-    except FileNotFoundError:
-        return False  # Channel not found
+    if not _is_text_channel(channel_name):
+        return False
+    with _channel_lock(channel_name):
+        if not _store.purge(channel_name, count):
+            return False
+        _cache.apply(channel_name, {"op": message_store.OP_PURGE, "count": count})
+    return True
 
 def can_user_delete_own(channel_name, user_roles):
     """
     Check if a user with specific roles can delete their own message in a channel.
     If the channel does not specify delete_own, all roles are allowed by default.
     """
-    try:
-        with open(channels_index, 'r', encoding='utf-8') as f:
-            channels_data = json.load(f)
-        for channel in channels_data:
-            if channel.get("name") == channel_name:
-                permissions = channel.get("permissions", {})
-                if "delete_own" not in permissions:
-                    return True  # Default: all roles can delete their own messages
-                allowed_roles = permissions.get("delete_own", [])
-                return any(role in allowed_roles for role in user_roles)
-    except FileNotFoundError:
-        return True  # Default to True if channel index not found
-    return True  # Default to True if channel not found
+    return _permissions.has(channel_name, user_roles, "delete_own", if_unset=True, if_missing=True)
 
 def can_user_edit_own(channel_name, user_roles):
     """
     Check if a user with specific roles can edit their own message in a channel.
     If the channel does not specify edit_own, all roles are allowed by default.
     """
-    try:
-        with open(channels_index, 'r', encoding='utf-8') as f:
-            channels_data = json.load(f)
-        for channel in channels_data:
-            if channel.get("name") == channel_name:
-                permissions = channel.get("permissions", {})
-                if "edit_own" not in permissions:
-                    return True  # Default: all roles can edit their own messages
-                allowed_roles = permissions.get("edit_own", [])
-                return any(role in allowed_roles for role in user_roles)
-    except FileNotFoundError:
-        return False
-    return False
+    return _permissions.has(channel_name, user_roles, "edit_own", if_unset=True)
 
 def can_user_react(channel_name, user_roles):
     """
     Check if a user with specific roles can react to messages in a channel.
     If the channel does not specify react, all roles are allowed by default.
     """
-    try:
-        with open(channels_index, 'r', encoding='utf-8') as f:
-            channels_data = json.load(f)
-        for channel in channels_data:
-            if channel.get("name") == channel_name:
-                permissions = channel.get("permissions", {})
-                if "react" not in permissions:
-                    return True  # Default: all roles can react
-                allowed_roles = permissions.get("react", [])
-                return any(role in allowed_roles for role in user_roles)
-    except FileNotFoundError:
-        return False
-    return False
+    return _permissions.has(channel_name, user_roles, "react", if_unset=True)
 
 def add_reaction(channel_name, message_id, emoji, user_id):
-    try:
-        with open(f"{channels_db_dir}/{channel_name}.json", "r", encoding="utf-8") as f:
-            channel_data = json.load(f)
-
-        for msg in channel_data:
-            if msg.get("id") == message_id:
-
-                msg.setdefault("reactions", {})
-                msg["reactions"].setdefault(emoji, [])
-
-                if user_id in msg["reactions"][emoji]:
-                    return True  # already reacted
-
-                msg["reactions"][emoji].append(user_id)
-
-                with open(f"{channels_db_dir}/{channel_name}.json", "w", encoding="utf-8") as f:
-                    json.dump(channel_data, f, separators=(",", ":"), ensure_ascii=False)
-
-                return True
+    """
+    Add a reaction from a user to a specific message in a channel.
 
-        return False
+    Args:
+        channel_name (str): The name of the channel.
+        message_id (str): The ID of the message to react to.
+        emoji (str): The emoji to react with.
+        user_id (str): The user adding the reaction.
 
-    except FileNotFoundError:
+    Returns:
+        bool: True if the reaction is present afterwards, False if the message or channel does not exist.
+    """
+    if not _is_text_channel(channel_name):
         return False
+    with _channel_lock(channel_name):
+        if not _store.add_reaction(channel_name, message_id, emoji, user_id):
+            return False
+        _cache.apply(channel_name, {"op": message_store.OP_REACT_ADD, "id": message_id, "emoji": emoji, "user": user_id})
+    return True
 
 def remove_reaction(channel_name, message_id, emoji, user_id):
-    try:
-        with open(f"{channels_db_dir}/{channel_name}.json", "r", encoding="utf-8") as f:
-            channel_data = json.load(f)
-
-        for msg in channel_data:
-            if msg.get("id") == message_id:
-
-                reactions = msg.get("reactions", {})
-                if emoji not in reactions:
-                    return False
-
-                if user_id not in reactions[emoji]:
-                    return False
-
-                reactions[emoji].remove(user_id)
-
-                if not reactions[emoji]:
-                    del reactions[emoji]
-                if not reactions:
-                    del msg["reactions"]
-
-                with open(f"{channels_db_dir}/{channel_name}.json", "w", encoding="utf-8") as f:
-                    json.dump(channel_data, f, separators=(",", ":"), ensure_ascii=False)
-
-                return True
+    """
+    Remove a user's reaction from a specific message in a channel.
 
-        return False
+    Args:
+        channel_name (str): The name of the channel.
+        message_id (str): The ID of the message.
+        emoji (str): The emoji to remove.
+        user_id (str): The user removing the reaction.
 
-    except FileNotFoundError:
+    Returns:
+        bool: True if the reaction was removed, False if there was no such reaction.
+    """
+    if not _is_text_channel(channel_name):
         return False
+    with _channel_lock(channel_name):
+        if not _store.remove_reaction(channel_name, message_id, emoji, user_id):
+            return False
+        _cache.apply(channel_name, {"op": message_store.OP_REACT_REMOVE, "id": message_id, "emoji": emoji, "user": user_id})
+    return True
    
 def get_reactions(channel_name, message_id):
     """
@@ -552,17 +632,10 @@ def get_reactions(channel_name, message_id):
     Returns:
         dict: A dictionary containing the reactions for the message, or None if the message or channel does not exist.
     """
-    try:
-        with open(f"{channels_db_dir}/{channel_name}.json", 'r', encoding='utf-8') as f:
-            channel_data = json.load(f)
-
-        for msg in channel_data:
-            if msg.get("id") == message_id:
-                return msg.get("reactions", {})
-        
-        return None
-    except FileNotFoundError:
+    msg = get_channel_message(channel_name, message_id)
+    if msg is None:
         return None
+    return msg.get("reactions", {})
     
 def get_reaction_users(channel_name, message_id, emoji):
     """
@@ -577,16 +650,9 @@ def get_reaction_users(channel_name, message_id, emoji):
         list: A list of usernames who reacted with the specified emoji, or None if the message or channel does not exist.
     """
     try:
-        with open(f"{channels_db_dir}/{channel_name}.json", 'r', encoding='utf-8') as f:
-            channel_data = json.load(f)
-
-        for msg in channel_data:
-            if msg.get("id") == message_id:
-                if emoji in msg.get("reactions", {}):
-                    return msg["reactions"][emoji]
-        
+        msg = get_channel_message(channel_name, message_id)
+    except json.JSONDecodeError:
         return None
-    except FileNotFoundError:
+    if msg is None:
         return None
-    except json.JSONDecodeError:
-        return None
\ No newline at end of file
+    return msg.get("reactions", {}).get(emoji)
\ No newline at end of file
@@ -0,0 +1,172 @@
+from .message_store import OP_DELETE, OP_PURGE, _apply_record
+
+def _copy_message(msg):
+    """Copy a message deeply enough that folding an edit or reaction into it leaves the original untouched."""
+    copied = dict(msg)
+    if "reactions" in msg:
+        copied["reactions"] = {emoji: list(reactors) for emoji, reactors in msg["reactions"].items()}
+    return copied
+
+class HotTailCache:
+    """
+    Per-channel buffer of the most recent messages.
+
+    Each cached channel holds a contiguous suffix of its history, so any lookup
+    that falls inside the buffer can be answered without touching disk. A channel
+    whose whole history fits in the buffer is marked complete, which also lets
+    misses inside it be answered from memory.
+
+    Entries are copy-on-write snapshots: a change builds a new entry and swaps
+    it in, and cached messages are never modified in place. Readers therefore
+    need no lock, even while another thread writes to the same channel. Writers
+    of one channel must be serialized by the caller. Lookups hand out copies,
+    so callers changing what they got cannot reach into a snapshot.
+    """
+
+    def __init__(self, size=200):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._channels = {}
+
+    def fill(self, channel_name, messages, complete=True):
+        """
+        Load the tail of a channel's history into the cache.
+
+        Args:
+            channel_name (str): The name of the channel.
+            messages (list): The most recent messages of the channel, oldest first.
+            complete (bool): Whether 'messages' is the channel's whole history.
+        """
+        if self.size <= 0:
+            return
+        self._publish(channel_name, tuple(messages[-self.size:]), complete and len(messages) <= self.size)
+
+    def _publish(self, channel_name, messages, complete, by_id=None):
+        if by_id is None:
+            by_id = {msg.get("id"): msg for msg in messages if msg.get("id")}
+        self._channels[channel_name] = {
+            "messages": messages,
+            "by_id": by_id,
+            "complete": complete
+        }
+
+    def drop(self, channel_name):
+        """Forget a channel so the next lookup reloads it from disk."""
+        self._channels.pop(channel_name, None)
+
+    def clear(self):
+        self._channels.clear()
+
+    def _hit(self, value):
+        self.hits += 1
+        return value
+
+    def _miss(self):
+        self.misses += 1
+        return None
+
+    def tail(self, channel_name, limit):
+        """
+        Get the last 'limit' messages of a channel.
+
+        Returns:
+            list: The messages, or None on a cache miss.
+        """
+        entry = self._channels.get(channel_name)
+        if entry is None or not isinstance(limit, int) or limit <= 0:
+            return self._miss()
+        messages = entry["messages"]
+        if limit > len(messages) and not entry["complete"]:
+            return self._miss()
+        return self._hit([_copy_message(msg) for msg in messages[max(len(messages) - limit, 0):]])
+
+    def find(self, channel_name, message_id):
+        """
+        Look up a message by ID.
+
+        Returns:
+            tuple: (True, message or None) if the cache can answer, (False, None) on a miss.
+        """
+        entry = self._channels.get(channel_name)
+        if entry is not None:
+            msg = entry["by_id"].get(message_id)
+            if msg is not None or entry["complete"]:
+                return self._hit((True, _copy_message(msg) if msg is not None else None))
+        self._miss()
+        return False, None
+
+    def replies(self, channel_name, message_id, limit):
+        """
+        Get the replies to a message. Replies are always newer than the message
+        they answer, so they are all cached whenever the message itself is.
+
+        Returns:
+            list: The replies, or None on a cache miss.
+        """
+        entry = self._channels.get(channel_name)
+        if entry is None or not (entry["complete"] or message_id in entry["by_id"]):
+            return self._miss()
+        replies = []
+        for msg in entry["messages"]:
+            if msg.get("reply_to", {}).get("id") == message_id:
+                replies.append(_copy_message(msg))
+                if len(replies) >= limit:
+                    break
+        return self._hit(replies)
+
+    def append(self, channel_name, message):
+        """Add a newly saved message to a cached channel."""
+        entry = self._channels.get(channel_name)
+        if entry is None:
+            return
+        # The caller keeps its dict, e.g. to broadcast it, so cache a copy of its own
+        message = _copy_message(message)
+        messages = entry["messages"]
+        complete = entry["complete"]
+        by_id = dict(entry["by_id"])
+        if len(messages) >= self.size:
+            evicted = len(messages) - self.size + 1
+            for msg in messages[:evicted]:
+                by_id.pop(msg.get("id"), None)
+            messages = messages[evicted:]
+            complete = False
+        if message.get("id"):
+            by_id[message["id"]] = message
+        self._publish(channel_name, messages + (message,), complete, by_id)
+
+    def apply(self, channel_name, record):
+        """Fold an edit, delete, reaction or purge record into a cached channel."""
+        entry = self._channels.get(channel_name)
+        if entry is None:
+            return
+        messages = entry["messages"]
+        op = record.get("op")
+        if op == OP_PURGE:
+            count = record.get("count", 0)
+            if count > len(messages) and not entry["complete"]:
+                self.drop(channel_name)
+                return
+            self._publish(channel_name, messages[:len(messages) - min(count, len(messages))], entry["complete"])
+        elif op == OP_DELETE:
+            msg = entry["by_id"].get(record.get("id"))
+            if msg is not None:
+                self._publish(channel_name, tuple(m for m in messages if m is not msg), entry["complete"])
+        else:
+            msg = entry["by_id"].get(record.get("id"))
+            if msg is None:
+                return
+            changed = {record.get("id"): _copy_message(msg)}
+            _apply_record(changed, record)
+            new_msg = changed[record.get("id")]
+            self._publish(channel_name, tuple(new_msg if m is msg else m for m in messages), entry["complete"])
+
+    def stats(self):
+        """Get the cache hit/miss counters and occupancy."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "channels": len(self._channels),
+            "messages": sum(len(entry["messages"]) for entry in self._channels.values()),
+            "size": self.size
+        }
@@ -0,0 +1,679 @@
+import json, os
+from itertools import islice
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No file locking on this platform
+
+# Record operations written to the channel logs
+OP_NEW = "new"
+OP_EDIT = "edit"
+OP_DELETE = "delete"
+OP_REACT_ADD = "react_add"
+OP_REACT_REMOVE = "react_remove"
+OP_PURGE = "purge"
+
+def is_safe_channel_name(channel_name):
+    """Check that a channel name can be used as a file name inside the channels directory."""
+    return (
+        isinstance(channel_name, str)
+        and channel_name != ""
+        and not channel_name.startswith(".")
+        and "/" not in channel_name
+        and "\\" not in channel_name
+        and "\0" not in channel_name
+    )
+
+def _encode(data):
+    """Encode a record the same compact way the channel files have always been written."""
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+class MessageStore:
+    """Base class for channel message storage engines"""
+
+    # Whether the engine can share its files with other server processes
+    supports_shared = False
+
+    def __init__(self):
+        # Whether other processes write to the same files
+        self.shared = False
+        # Called with (channel_name, record) for every record written by another process
+        self.record_listeners = []
+        # Called with (channel_name) after every write made by this process
+        self.write_listeners = []
+
+    def _checked_name(self, channel_name):
+        """Refuse channel names that would resolve to a file outside the channels directory."""
+        if not is_safe_channel_name(channel_name):
+            raise ValueError(f"Invalid channel name: {channel_name!r}")
+        return channel_name
+
+    def _notify_write(self, channel_name):
+        for listener in self.write_listeners:
+            listener(channel_name)
+
+    def read(self, channel_name):
+        """
+        Read every message of a channel in chronological order.
+
+        Returns:
+            list: The messages, or None if the channel has no message data.
+        """
+        raise NotImplementedError
+
+    def read_tail(self, channel_name, limit):
+        """
+        Read the last 'limit' messages of a channel.
+
+        Returns:
+            list: The messages, or None if the channel has no message data.
+        """
+        channel_data = self.read(channel_name)
+        if channel_data is None:
+            return None
+        return channel_data[-limit:]
+
+    def get(self, channel_name, message_id):
+        """
+        Get a single message by ID.
+
+        Returns:
+            dict: The message, or None if it does not exist.
+        """
+        for msg in self.read(channel_name) or []:
+            if msg.get("id") == message_id:
+                return msg
+        return None
+
+    def prepare(self, channel_name):
+        """Load any per-channel state ahead of the first request."""
+        pass
+
+    def sync(self, channel_name):
+        """Pick up the records other processes have written to a channel since the last look."""
+        pass
+
+    def compact_if_needed(self, channel_name):
+        """Compact a channel's files if they have grown mostly dead. Returns True if they were compacted."""
+        return False
+
+    def append(self, channel_name, message):
+        """Append a new message to a channel."""
+        raise NotImplementedError
+
+    def edit(self, channel_name, message_id, new_content):
+        """Replace the content of a message. Returns False if it does not exist."""
+        raise NotImplementedError
+
+    def delete(self, channel_name, message_id):
+        """Delete a message. Returns False if the channel has no message data."""
+        raise NotImplementedError
+
+    def add_reaction(self, channel_name, message_id, emoji, user_id):
+        """Add a reaction to a message. Returns False if the message does not exist."""
+        raise NotImplementedError
+
+    def remove_reaction(self, channel_name, message_id, emoji, user_id):
+        """Remove a reaction from a message. Returns False if there was nothing to remove."""
+        raise NotImplementedError
+
+    def purge(self, channel_name, count):
+        """Remove the last 'count' messages. Returns False if there are fewer messages."""
+        raise NotImplementedError
+
+    def drop(self, channel_name):
+        """Remove all message data of a channel. Raises FileNotFoundError if there is none."""
+        raise NotImplementedError
+
+class JsonFileStore(MessageStore):
+    """Legacy engine keeping each channel as a single JSON array that is rewritten on every change"""
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def _path(self, channel_name):
+        return f"{self.directory}/{self._checked_name(channel_name)}.json"
+
+    def _load(self, channel_name):
+        with open(self._path(channel_name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save(self, channel_name, channel_data):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(channel_name), 'w', encoding='utf-8') as f:
+            json.dump(channel_data, f, separators=(',', ':'), ensure_ascii=False)
+
+    def read(self, channel_name):
+        try:
+            return self._load(channel_name)
+        except FileNotFoundError:
+            return None
+
+    def append(self, channel_name, message):
+        channel_data = self.read(channel_name) or []
+        channel_data.append(message)
+        self._save(channel_name, channel_data)
+
+    def edit(self, channel_name, message_id, new_content):
+        channel_data = self.read(channel_name)
+        if channel_data is None:
+            return False
+        for msg in channel_data:
+            if msg.get("id") == message_id:
+                _apply_record({message_id: msg}, {"op": OP_EDIT, "id": message_id, "content": new_content})
+                self._save(channel_name, channel_data)
+                return True
+        return False
+
+    def delete(self, channel_name, message_id):
+        channel_data = self.read(channel_name)
+        if channel_data is None:
+            return False
+        self._save(channel_name, [msg for msg in channel_data if msg.get("id") != message_id])
+        return True
+
+    def add_reaction(self, channel_name, message_id, emoji, user_id):
+        channel_data = self.read(channel_name)
+        if channel_data is None:
+            return False
+        for msg in channel_data:
+            if msg.get("id") == message_id:
+                if user_id not in msg.get("reactions", {}).get(emoji, []):
+                    _apply_record({message_id: msg}, {"op": OP_REACT_ADD, "id": message_id, "emoji": emoji, "user": user_id})
+                    self._save(channel_name, channel_data)
+                return True
+        return False
+
+    def remove_reaction(self, channel_name, message_id, emoji, user_id):
+        channel_data = self.read(channel_name)
+        if channel_data is None:
+            return False
+        for msg in channel_data:
+            if msg.get("id") == message_id:
+                if user_id not in msg.get("reactions", {}).get(emoji, []):
+                    return False
+                _apply_record({message_id: msg}, {"op": OP_REACT_REMOVE, "id": message_id, "emoji": emoji, "user": user_id})
+                self._save(channel_name, channel_data)
+                return True
+        return False
+
+    def purge(self, channel_name, count):
+        channel_data = self.read(channel_name)
+        if channel_data is None or len(channel_data) < count:
+            return False
+        self._save(channel_name, channel_data[:-count])
+        return True
+
+    def drop(self, channel_name):
+        os.remove(self._path(channel_name))
+
+class _LogIndex:
+    """In-memory index of one channel log: message key -> offsets of its record and patches"""
+
+    def __init__(self):
+        self.entries = {}
+        self.records = 0
+        self.scanned_to = 0
+
+    def apply(self, entry):
+        """Fold one index entry ([offset, op, id or purge count]) into the index."""
+        offset, op, key = entry
+        self.records += 1
+        if op == OP_NEW:
+            self.entries[_message_key(key, offset)] = [offset]
+        elif op == OP_PURGE:
+            for _ in range(min(key, len(self.entries))):
+                self.entries.popitem()
+        elif op == OP_DELETE:
+            self.entries.pop(key, None)
+        elif key in self.entries:
+            self.entries[key] = self.entries[key] + [offset]
+
+class AppendLogStore(MessageStore):
+    """
+    Engine keeping each channel as an append-only, line-delimited log.
+
+    A new message costs a single append. Edits, deletes, reactions and purges
+    are appended as patch or tombstone records and folded in when the log is
+    read. Every channel also has a persistent index (<name>.idx) from message
+    ID to the offsets of its records, so single-message operations seek
+    straight to them instead of replaying the log. Logs are compacted once the
+    dead records outnumber the live messages.
+    """
+
+    supports_shared = True
+
+    def __init__(self, directory, compact_min_records=1024):
+        super().__init__()
+        self.directory = directory
+        self.compact_min_records = compact_min_records
+        self._indexes = {}
+
+    def _log_path(self, channel_name):
+        return f"{self.directory}/{self._checked_name(channel_name)}.log"
+
+    def _index_path(self, channel_name):
+        return f"{self.directory}/{self._checked_name(channel_name)}.idx"
+
+    def _legacy_path(self, channel_name):
+        return f"{self.directory}/{self._checked_name(channel_name)}.json"
+
+    def _has_log(self, channel_name):
+        """Check for a channel log, migrating a legacy JSON channel file first if there is one."""
+        log_path = self._log_path(channel_name)
+        if os.path.exists(log_path):
+            return True
+
+        legacy_path = self._legacy_path(channel_name)
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                channel_data = json.load(f)
+        except FileNotFoundError:
+            return False
+        if not isinstance(channel_data, list):
+            return False  # Not a channel file, leave it alone
+
+        self._write_log(channel_name, [msg for msg in channel_data if isinstance(msg, dict)])
+        os.replace(legacy_path, legacy_path + ".migrated")
+        return True
+
+    def _write_log(self, channel_name, messages):
+        """Atomically replace a channel log with one record per message."""
+        os.makedirs(self.directory, exist_ok=True)
+        log_path = self._log_path(channel_name)
+        tmp_path = log_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for msg in messages:
+                f.write(_encode({"op": OP_NEW, "msg": msg}) + "\n")
+        os.replace(tmp_path, log_path)
+
+    def _append_record(self, channel_name, record):
+        """
+        Append one record with a single write so concurrent appends never interleave.
+
+        Returns:
+            int: The offset the record was written at.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        data = (_encode(record) + "\n").encode('utf-8')
+        fd = os.open(self._log_path(channel_name), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            return os.lseek(fd, 0, os.SEEK_CUR) - len(data)
+        finally:
+            os.close(fd)
+
+    def _index(self, channel_name):
+        """
+        Get the index of a channel, loading it from its .idx file and catching up
+        with any log records written after it. Returns None if there is no log.
+        """
+        index = self._indexes.get(channel_name)
+        if index is not None:
+            return index
+        if not self._has_log(channel_name):
+            return None
+
+        index = self._load_index(channel_name)
+        if index is None:
+            # Missing or stale index file, rebuild it from the log
+            index = _LogIndex()
+            try:
+                os.remove(self._index_path(channel_name))
+            except FileNotFoundError:
+                pass
+        self._catch_up(channel_name, index)
+        self._indexes[channel_name] = index
+        return index
+
+    def _load_index(self, channel_name):
+        """Load a persisted index, or return None if it is missing or does not match the log."""
+        index = _LogIndex()
+        last = None
+        try:
+            with open(self._index_path(channel_name), 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Torn write at the end of the index
+                    index.apply(entry)
+                    last = entry
+        except FileNotFoundError:
+            return None
+        if last is None:
+            return None
+
+        # The last indexed record must still be where the index says it is
+        with open(self._log_path(channel_name), 'rb') as f:
+            f.seek(last[0])
+            line = f.readline()
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        if not _is_record(record) or _index_entry(last[0], record) != last:
+            return None
+        index.scanned_to = last[0] + len(line)
+        return index
+
+    def _catch_up(self, channel_name, index, own_offset=None, notify=False):
+        """
+        Index every complete log record past the indexed end and persist the new entries.
+        With 'notify', records other than the one at 'own_offset' are passed to the record listeners.
+        """
+        new_entries = []
+        foreign_records = []
+        with open(self._log_path(channel_name), 'rb') as f:
+            f.seek(index.scanned_to)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Record still being written
+                offset = index.scanned_to
+                index.scanned_to += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not _is_record(record):
+                    continue  # Not a log record
+                entry = _index_entry(offset, record)
+                index.apply(entry)
+                new_entries.append(entry)
+                if notify and offset != own_offset:
+                    foreign_records.append(record)
+
+        if new_entries:
+            self._persist_index_entries(channel_name, new_entries)
+        for record in foreign_records:
+            for listener in self.record_listeners:
+                listener(channel_name, record)
+
+    def _persist_index_entries(self, channel_name, entries):
+        """Append entries to a channel's .idx file."""
+        with open(self._index_path(channel_name), 'a+b') as f:
+            if self.shared:
+                # Other processes index the same records, so only add what nobody has written yet
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                last_offset = _last_index_offset(f)
+                entries = [entry for entry in entries if entry[0] > last_offset]
+            f.write("".join(_encode(entry) + "\n" for entry in entries).encode('utf-8'))
+
+    def _lookup(self, channel_name, index, message_id):
+        """
+        Get the offsets of a message, catching up with other processes' records first
+        if it is not indexed yet. Returns None if the message does not exist.
+        """
+        offsets = index.entries.get(message_id)
+        if offsets is None and self.shared:
+            self._catch_up(channel_name, index, notify=True)
+            offsets = index.entries.get(message_id)
+        return offsets
+
+    def _write(self, channel_name, index, record):
+        """Append a record, index it and compact the log if it has become mostly dead records."""
+        offset = self._append_record(channel_name, record)
+        self._catch_up(channel_name, index, own_offset=offset, notify=True)
+        # Other processes hold offsets into the log, so shared logs are only compacted at startup
+        if not self.shared:
+            self._compact_if_dead(channel_name, index)
+        self._notify_write(channel_name)
+
+    def _compact_if_dead(self, channel_name, index):
+        dead = index.records - len(index.entries)
+        if dead > self.compact_min_records and dead > len(index.entries):
+            return self.compact(channel_name)
+        return False
+
+    def _read_message(self, f, offsets):
+        """Read a message record and fold its patch records into it."""
+        f.seek(offsets[0])
+        msg = json.loads(f.readline()).get("msg", {})
+        for offset in offsets[1:]:
+            f.seek(offset)
+            record = json.loads(f.readline())
+            _apply_record({record.get("id"): msg}, record)
+        return msg
+
+    def _fold(self, channel_name):
+        """
+        Replay a whole channel log.
+
+        Returns:
+            dict: Message key -> message in order, or None if there is no log.
+        """
+        if not self._has_log(channel_name):
+            return None
+
+        messages = {}
+        offset = 0
+        with open(self._log_path(channel_name), 'rb') as f:
+            for line in f:
+                line_offset = offset
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Torn write at the end of the log
+                if not _is_record(record):
+                    continue  # Not a log record
+                _apply_record(messages, record, line_offset)
+        return messages
+
+    def prepare(self, channel_name):
+        self._index(channel_name)
+
+    def sync(self, channel_name):
+        index = self._indexes.get(channel_name)
+        if index is not None:
+            self._catch_up(channel_name, index, notify=True)
+
+    def compact_if_needed(self, channel_name):
+        index = self._index(channel_name)
+        if index is None:
+            return False
+        return self._compact_if_dead(channel_name, index)
+
+    def compact(self, channel_name):
+        """
+        Rewrite a channel log so it only holds the live messages, and reindex it.
+
+        Returns:
+            bool: True if the log was compacted, False if the channel has no log.
+        """
+        messages = self._fold(channel_name)
+        if messages is None:
+            return False
+        self._write_log(channel_name, messages.values())
+        try:
+            os.remove(self._index_path(channel_name))
+        except FileNotFoundError:
+            pass
+        index = _LogIndex()
+        self._catch_up(channel_name, index)
+        self._indexes[channel_name] = index
+        return True
+
+    def read(self, channel_name):
+        messages = self._fold(channel_name)
+        if messages is None:
+            return None
+        return list(messages.values())
+
+    def read_tail(self, channel_name, limit):
+        index = self._index(channel_name)
+        if index is None:
+            return None
+        tail = list(islice(reversed(index.entries.values()), limit))
+        with open(self._log_path(channel_name), 'rb') as f:
+            return [self._read_message(f, offsets) for offsets in reversed(tail)]
+
+    def get(self, channel_name, message_id):
+        index = self._index(channel_name)
+        offsets = self._lookup(channel_name, index, message_id) if index is not None else None
+        if offsets is None:
+            return None
+        with open(self._log_path(channel_name), 'rb') as f:
+            return self._read_message(f, offsets)
+
+    def append(self, channel_name, message):
+        index = self._index(channel_name)
+        if index is None:
+            self._append_record(channel_name, {"op": OP_NEW, "msg": message})
+            self._index(channel_name)
+            self._notify_write(channel_name)
+            return
+        self._write(channel_name, index, {"op": OP_NEW, "msg": message})
+
+    def edit(self, channel_name, message_id, new_content):
+        index = self._index(channel_name)
+        if index is None or self._lookup(channel_name, index, message_id) is None:
+            return False
+        self._write(channel_name, index, {"op": OP_EDIT, "id": message_id, "content": new_content})
+        return True
+
+    def delete(self, channel_name, message_id):
+        index = self._index(channel_name)
+        if index is None:
+            return False
+        if self._lookup(channel_name, index, message_id) is not None:
+            self._write(channel_name, index, {"op": OP_DELETE, "id": message_id})
+        return True
+
+    def add_reaction(self, channel_name, message_id, emoji, user_id):
+        msg = self.get(channel_name, message_id)
+        if msg is None:
+            return False
+        if user_id not in msg.get("reactions", {}).get(emoji, []):
+            self._write(channel_name, self._index(channel_name), {"op": OP_REACT_ADD, "id": message_id, "emoji": emoji, "user": user_id})
+        return True
+
+    def remove_reaction(self, channel_name, message_id, emoji, user_id):
+        msg = self.get(channel_name, message_id)
+        if msg is None or user_id not in msg.get("reactions", {}).get(emoji, []):
+            return False
+        self._write(channel_name, self._index(channel_name), {"op": OP_REACT_REMOVE, "id": message_id, "emoji": emoji, "user": user_id})
+        return True
+
+    def purge(self, channel_name, count):
+        index = self._index(channel_name)
+        if index is not None and self.shared:
+            self._catch_up(channel_name, index, notify=True)
+        if index is None or len(index.entries) < count:
+            return False
+        self._write(channel_name, index, {"op": OP_PURGE, "count": count})
+        return True
+
+    def drop(self, channel_name):
+        if not self._has_log(channel_name):
+            raise FileNotFoundError(self._log_path(channel_name))
+        self._indexes.pop(channel_name, None)
+        os.remove(self._log_path(channel_name))
+        try:
+            os.remove(self._index_path(channel_name))
+        except FileNotFoundError:
+            pass
+
+def _last_index_offset(f):
+    """Get the log offset of the last complete entry in an open .idx file, or -1 if there is none."""
+    size = f.seek(0, os.SEEK_END)
+    if size == 0:
+        return -1
+    f.seek(max(0, size - 4096))
+    lines = f.read().split(b"\n")
+    for line in reversed(lines[:-1]):
+        try:
+            return json.loads(line)[0]
+        except (ValueError, IndexError, TypeError):
+            continue
+    return -1
+
+def _is_record(record):
+    """Check that a decoded log line is a record the index and the fold can use."""
+    if not isinstance(record, dict):
+        return False
+    if record.get("op") == OP_NEW:
+        msg = record.get("msg")
+        return isinstance(msg, dict) and isinstance(msg.get("id"), (str, int, type(None)))
+    if record.get("op") == OP_PURGE:
+        return isinstance(record.get("count", 0), int)
+    return isinstance(record.get("id"), (str, int, type(None)))
+
+def _index_entry(offset, record):
+    """Build the index entry for a log record: [offset, op, message ID or purge count]."""
+    op = record.get("op")
+    if op == OP_NEW:
+        return [offset, op, record.get("msg", {}).get("id")]
+    if op == OP_PURGE:
+        return [offset, op, record.get("count", 0)]
+    return [offset, op, record.get("id")]
+
+def _message_key(message_id, offset):
+    """Get the key of a message in a channel log: its ID, or its record's offset if it has none."""
+    return message_id if message_id is not None else ("", offset)
+
+def _apply_record(messages, record, offset=0):
+    """
+    Fold a single log record into an ordered dict of message key -> message.
+
+    Messages without an ID are keyed by the offset of their record in the log.
+    """
+    op = record.get("op")
+    if op == OP_NEW:
+        msg = record.get("msg", {})
+        messages[_message_key(msg.get("id"), offset)] = msg
+        return
+
+    if op == OP_PURGE:
+        for _ in range(min(record.get("count", 0), len(messages))):
+            messages.popitem()
+        return
+
+    message_id = record.get("id")
+    if op == OP_DELETE:
+        messages.pop(message_id, None)
+        return
+
+    msg = messages.get(message_id)
+    if msg is None:
+        return
+
+    if op == OP_EDIT:
+        msg["content"] = record.get("content")
+        msg["edited"] = True
+    elif op == OP_REACT_ADD:
+        reactors = msg.setdefault("reactions", {}).setdefault(record.get("emoji"), [])
+        if record.get("user") not in reactors:
+            reactors.append(record.get("user"))
+    elif op == OP_REACT_REMOVE:
+        reactions = msg.get("reactions", {})
+        reactors = reactions.get(record.get("emoji"), [])
+        if record.get("user") in reactors:
+            reactors.remove(record.get("user"))
+            if not reactors:
+                del reactions[record.get("emoji")]
+            if not reactions:
+                del msg["reactions"]
+
+ENGINES = {
+    "log": AppendLogStore,
+    "json": JsonFileStore,
+}
+
+def create_store(engine, directory):
+    """
+    Create a message store by engine name.
+
+    Args:
+        engine (str): The engine name, "log" (default) or "json".
+        directory (str): The directory holding the channel message files.
+
+    Returns:
+        MessageStore: The storage engine.
+    """
+    store_class = ENGINES.get(engine)
+    if store_class is None:
+        raise ValueError(f"Unknown message storage engine: {engine}")
+    return store_class(directory)
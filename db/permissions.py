@@ -0,0 +1,109 @@
+import json
+
+class PermissionMatrix:
+    """
+    Compiled view of the channel permissions in channels.json.
+
+    Every role gets a bit, and every (channel, permission) pair is compiled to
+    the bitset of roles it allows, so a permission check is a dict lookup and
+    a bitwise AND. The matrix is compiled lazily and thrown away by
+    invalidate() whenever channels.json changes.
+    """
+
+    def __init__(self, channels_index):
+        self.channels_index = channels_index
+        self.version = 0
+        self._snapshot = None
+
+    def invalidate(self):
+        """Drop the compiled matrix so the next check recompiles channels.json."""
+        self.version += 1
+        self._snapshot = None
+
+    def _compile(self):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+
+        version = self.version
+        try:
+            with open(self.channels_index, 'r', encoding='utf-8') as f:
+                all_channels = json.load(f)
+        except FileNotFoundError:
+            all_channels = None
+
+        snapshot = {"roles": {}, "channels": {}, "order": all_channels, "visible": {}, "text": set()}
+        for channel in all_channels or []:
+            # Channels without a type are text channels
+            if channel.get("type", "text") == "text" and isinstance(channel.get("name"), str):
+                snapshot["text"].add(channel.get("name"))
+            masks = {}
+            for permission, allowed_roles in channel.get("permissions", {}).items():
+                masks[permission] = self._mask(snapshot["roles"], allowed_roles, assign=True)
+            snapshot["channels"].setdefault(channel.get("name"), masks)
+
+        # Only publish the matrix if channels.json was not changed while compiling it
+        if version == self.version:
+            self._snapshot = snapshot
+        return snapshot
+
+    @staticmethod
+    def _mask(role_bits, roles, assign=False):
+        mask = 0
+        for role in roles:
+            bit = role_bits.get(role)
+            if bit is None:
+                if not assign:
+                    continue
+                bit = role_bits[role] = 1 << len(role_bits)
+            mask |= bit
+        return mask
+
+    def has(self, channel_name, user_roles, permission, if_unset=False, if_missing=False):
+        """
+        Check if any of the roles has a permission on a channel.
+
+        Args:
+            channel_name (str): The name of the channel.
+            user_roles (list): The roles to check.
+            permission (str): The permission to check (e.g., "view", "send").
+            if_unset (bool): Result when the channel does not list the permission at all.
+            if_missing (bool): Result when the channel or channels.json does not exist.
+
+        Returns:
+            bool: True if the permission is granted.
+        """
+        snapshot = self._compile()
+        masks = snapshot["channels"].get(channel_name)
+        if masks is None:
+            return if_missing
+        allowed = masks.get(permission)
+        if allowed is None:
+            return if_unset
+        return bool(allowed & self._mask(snapshot["roles"], user_roles))
+
+    def is_text_channel(self, channel_name):
+        """Check if channels.json declares a text channel with this name."""
+        return channel_name in self._compile()["text"]
+
+    def is_declared(self, channel_name):
+        """Check if channels.json declares a channel with this name."""
+        return channel_name in self._compile()["channels"]
+
+    def channels_for_roles(self, roles):
+        """
+        Get the channels any of the roles can view, in channels.json order.
+
+        Returns:
+            list: A list of channel info dicts.
+        """
+        snapshot = self._compile()
+        mask = self._mask(snapshot["roles"], roles)
+        visible = snapshot["visible"].get(mask)
+        if visible is None:
+            visible = [
+                channel for channel in snapshot["order"] or []
+                if snapshot["channels"].get(channel.get("name"), {}).get("view", 0) & mask
+            ]
+            snapshot["visible"][mask] = visible
+        return list(visible)
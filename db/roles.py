@@ -4,6 +4,41 @@ _MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 roles_index = os.path.join(_MODULE_DIR, "roles.json")
 
+# Resident copy of roles.json, dropped whenever the file changes
+_roles = None
+# Bumped on every change to roles.json so callers can tell when cached colors are stale
+_version = 0
+
+def get_version():
+    """
+    Get a counter that changes every time role data may have changed.
+    """
+    return _version
+
+def invalidate():
+    """
+    Drop the cached roles after roles.json has changed.
+    """
+    global _roles, _version
+    _roles = None
+    _version += 1
+
+def _get_roles():
+    """Get the cached roles dict, loading roles.json if needed."""
+    global _roles
+    roles = _roles
+    if roles is None:
+        version = _version
+        try:
+            with open(roles_index, "r") as f:
+                roles = json.load(f)
+        except FileNotFoundError:
+            roles = {}
+        # Only publish the cache if roles.json was not changed while loading it
+        if version == _version:
+            _roles = roles
+    return roles
+
 def get_role(role_name):
     """
     Retrieve role data by role name.
@@ -14,12 +49,21 @@ def get_role(role_name):
     Returns:
         dict: The role data if found, None otherwise.
     """
-    try:
-        with open(roles_index, "r") as f:
-            roles = json.load(f)
-        return roles.get(role_name, None)
-    except FileNotFoundError:
-        return None
+    role = _get_roles().get(role_name, None)
+    return dict(role) if role is not None else None
+
+def get_role_color(role_name):
+    """
+    Get the display color of a role.
+
+    Args:
+        role_name (str): The name of the role.
+
+    Returns:
+        str: The role's color, or None if the role does not exist or has no color.
+    """
+    role = _get_roles().get(role_name)
+    return role.get("color") if role else None
 
 def get_all_roles():
     """
@@ -28,12 +72,7 @@ def get_all_roles():
     Returns:
         dict: A dictionary of all roles.
     """
-    try:
-        with open(roles_index, "r") as f:
-            roles = json.load(f)
-        return roles
-    except FileNotFoundError:
-        return {}
+    return {role_name: dict(role_data) for role_name, role_data in _get_roles().items()}
 
 def add_role(role_name, role_data):
     """
@@ -59,6 +98,7 @@ def add_role(role_name, role_data):
 
     with open(roles_index, "w") as f:
         json.dump(roles, f, indent=4)
+    invalidate()
 
     return True
 
@@ -86,6 +126,7 @@ def update_role(role_name, role_data):
 
     with open(roles_index, "w") as f:
         json.dump(roles, f, indent=4)
+    invalidate()
 
     return True
 
@@ -114,6 +155,7 @@ def update_role_key(role_name, key, value):
 
     with open(roles_index, "w") as f:
         json.dump(roles, f, indent=4)
+    invalidate()
 
     return True
 
@@ -140,6 +182,7 @@ def delete_role(role_name):
 
     with open(roles_index, "w") as f:
         json.dump(roles, f, indent=4)
+    invalidate()
 
     return True
 
@@ -153,9 +196,4 @@ def role_exists(role_name):
     Returns:
         bool: True if the role exists, False otherwise.
     """
-    try:
-        with open(roles_index, "r") as f:
-            roles = json.load(f)
-        return role_name in roles
-    except FileNotFoundError:
-        return False  # Roles database does not exist
\ No newline at end of file
+    return role_name in _get_roles()
\ No newline at end of file
@@ -1,5 +1,10 @@
-import json, os
+import json, os, copy, threading, atexit
+from contextlib import contextmanager
 from . import roles
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No file locking on this platform
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from logger import Logger
@@ -8,45 +13,237 @@ _MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
 users_index = os.path.join(_MODULE_DIR, "users.json")
 config = json.load(open(os.path.join(_MODULE_DIR, "..", "config.json"), "r"))
 
-def user_exists(user_id):
+# Write-behind settings: changes are flushed after this many seconds, or as soon as this many users are dirty
+_users_config = config.get("DB", {}).get("users", {})
+_flush_interval = _users_config.get("flush_interval", 2)
+_flush_threshold = _users_config.get("flush_threshold", 50)
+
+# Resident copy of users.json, loaded on first use
+_lock = threading.RLock()
+_users = None
+# Users changed in memory but not yet written to users.json
+_dirty = set()
+_flush_timer = None
+# Serializes flushes, which run without holding _lock while they write the file
+_flush_lock = threading.Lock()
+# (mtime, size) of users.json as last read or written by this module
+_file_stat = None
+# Whether other worker processes write users.json too
+_shared = False
+
+# Bumped on every change to users.json so callers can tell when cached roles are stale
+_version = 0
+# Bumped only when a user's roles change, or a user is added or removed
+_roles_version = 0
+
+# username -> {"username", "roles", "color"} display projection, valid for _projections_roles_version
+_projections = {}
+_projections_roles_version = None
+
+def get_version():
     """
-    Check if a user exists in the users database.
+    Get a counter that changes every time user data may have changed.
     """
-    try:
-        with open(users_index, "r") as f:
-            users = json.load(f)
-        return user_id in users
-    except FileNotFoundError:
-        return False
+    return _version
 
-def get_user(user_id):
+def invalidate():
     """
-    Get user data by user ID.
+    Mark user data as changed so cached roles are recomputed.
+    """
+    global _version
+    _version += 1
+
+def get_roles_version():
     """
+    Get a counter that changes only when a user's roles may have changed,
+    or a user was added or removed.
+    """
+    return _roles_version
+
+def _invalidate_roles():
+    global _roles_version
+    _roles_version += 1
+
+def _roles_of(user_data):
+    return user_data.get("roles") if user_data is not None else None
+
+def set_shared_storage(shared=True):
+    """
+    Tell the module that other server processes write users.json too,
+    so every flush merges their changes instead of overwriting them.
+    """
+    global _shared
+    _shared = shared
+
+def _stat_file():
     try:
-        with open(users_index, "r") as f:
-            users = json.load(f)
-        return users.get(user_id, None)
+        st = os.stat(users_index)
+        return (st.st_mtime_ns, st.st_size)
     except FileNotFoundError:
         return None
 
-def add_user(user_id):
-    """
-    Add a new user to the users database.
-    """
+def _read_file():
+    global _file_stat
     try:
         with open(users_index, "r") as f:
             users = json.load(f)
     except FileNotFoundError:
         users = {}
+    _file_stat = _stat_file()
+    return users
+
+def _get_users():
+    """Get the resident users dict, loading users.json the first time."""
+    global _users
+    if _users is None:
+        _users = _read_file()
+    return _users
+
+def _mark_dirty(user_id):
+    """Record a change to a user and schedule it to be written to disk. Must be called with _lock held."""
+    global _flush_timer
+    _dirty.add(user_id)
+    _projections.pop(user_id, None)
+    invalidate()
+    if len(_dirty) >= _flush_threshold:
+        # Flush right away, but on the timer thread so the caller never waits on the disk
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+        _flush_timer = threading.Timer(0, flush)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+    elif _flush_timer is None:
+        _flush_timer = threading.Timer(_flush_interval, flush)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+@contextmanager
+def _file_lock():
+    """Hold an exclusive lock on users.json against other server processes, where supported."""
+    if fcntl is None:
+        yield
+        return
+    with open(users_index + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+def flush():
+    """
+    Write all pending user changes to users.json in one atomic batch.
+    If users.json changed on disk since it was last read or written here, changes
+    made by others to users that are not dirty here are kept and loaded.
+
+    The in-memory users are only locked while the pending changes are picked up
+    and merged back, not while users.json is read and written, so reads keep
+    being served during a flush.
+    """
+    global _flush_timer, _file_stat
+    with _flush_lock:
+        with _lock:
+            if _flush_timer is not None:
+                _flush_timer.cancel()
+                _flush_timer = None
+            if not _dirty:
+                return
+            # Stored user dicts are replaced on change, never modified, so references make a stable snapshot
+            pending = {user_id: _users.get(user_id) for user_id in _dirty}
+            snapshot = dict(_users)
+
+        # Other worker processes merge into the same file, so read-merge-write under the file lock
+        with _file_lock():
+            if _shared or _stat_file() != _file_stat:
+                merged = _read_file()
+                for user_id, user_data in pending.items():
+                    if user_data is not None:
+                        merged[user_id] = user_data
+                    else:
+                        merged.pop(user_id, None)
+            else:
+                merged = None  # Nobody else wrote the file, so the resident copy is all there is
+
+            tmp_path = users_index + f".{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(merged if merged is not None else snapshot, f, indent=4)
+            os.replace(tmp_path, users_index)
+            written_stat = _stat_file()
+
+        with _lock:
+            _file_stat = written_stat
+            # Users changed again while writing stay dirty for the next flush
+            for user_id, user_data in pending.items():
+                if _users.get(user_id) is user_data:
+                    _dirty.discard(user_id)
+            if merged is None:
+                return
+
+            # Changes merged in from another process would otherwise never be seen, as the watcher skips our own write
+            foreign = [
+                user_id for user_id in merged.keys() | _users.keys()
+                if user_id not in pending and user_id not in _dirty and merged.get(user_id) != _users.get(user_id)
+            ]
+            roles_changed = False
+            for user_id in foreign:
+                roles_changed = roles_changed or _roles_of(merged.get(user_id)) != _roles_of(_users.get(user_id))
+                if user_id in merged:
+                    _users[user_id] = merged[user_id]
+                else:
+                    _users.pop(user_id, None)
+                _projections.pop(user_id, None)
+            if foreign:
+                invalidate()
+            if roles_changed:
+                _invalidate_roles()
+
+def reload():
+    """
+    Reload users.json after it was modified outside this module.
+    Pending changes made here are kept on top of the new file contents.
+    """
+    global _users
+    with _lock:
+        if _users is None or _stat_file() == _file_stat:
+            return  # Not loaded yet, or the change is our own write
+        fresh = _read_file()
+        for user_id in _dirty:
+            if user_id in _users:
+                fresh[user_id] = _users[user_id]
+            else:
+                fresh.pop(user_id, None)
+        if any(_roles_of(fresh.get(user_id)) != _roles_of(_users.get(user_id)) for user_id in fresh.keys() | _users.keys()):
+            _invalidate_roles()
+        _users = fresh
+        _projections.clear()
+        invalidate()
+
+atexit.register(flush)
+
+def user_exists(user_id):
+    """
+    Check if a user exists in the users database.
+    """
+    with _lock:
+        return user_id in _get_users()
 
-    if user_id in users:
-        return False  # User already exists
+def get_user(user_id):
+    """
+    Get user data by user ID.
+    """
+    with _lock:
+        user = _get_users().get(user_id, None)
+        return copy.deepcopy(user) if user is not None else None
 
-    users[user_id] = config["DB"]["users"]["default"].copy()
+def add_user(user_id):
+    """
+    Add a new user to the users database.
+    """
+    with _lock:
+        users = _get_users()
+        if user_id in users:
+            return False  # User already exists
 
-    with open(users_index, "w") as f:
-        json.dump(users, f, indent=4)
+        users[user_id] = copy.deepcopy(config["DB"]["users"]["default"])
+        _invalidate_roles()
+        _mark_dirty(user_id)
 
     return True
 
@@ -54,83 +251,92 @@ def get_user_roles(user_id):
     """
     Get the roles of a user.
     """
-    user = get_user(user_id)
-    if user:
-        return user.get("roles", [])
+    with _lock:
+        user = _get_users().get(user_id)
+        if user:
+            return list(user.get("roles", []))
     return []
 
-def get_users():
+def _projection(user_id, user_data):
+    """Get the cached display projection of a user. Must be called with _lock held."""
+    global _projections_roles_version
+    roles_version = roles.get_version()
+    if roles_version != _projections_roles_version:
+        # Role colors may have changed, so every projection is stale
+        _projections.clear()
+        _projections_roles_version = roles_version
+
+    projection = _projections.get(user_id)
+    if projection is None:
+        user_roles = list(user_data.get("roles", []))
+        projection = {
+            "username": user_id,
+            "roles": user_roles,
+            # Users are shown in the color of their first role
+            "color": roles.get_role_color(user_roles[0]) if user_roles else None
+        }
+        _projections[user_id] = projection
+    return projection
+
+def get_user_projection(user_id):
     """
-    Get all users from the users database.
+    Get the public display data of a user.
+
+    Returns:
+        dict: {"username", "roles", "color"}, or None if the user does not exist.
+            The dict is shared and must not be modified.
     """
-    try:
-        with open(users_index, "r") as f:
-            users = json.load(f)
+    with _lock:
+        user_data = _get_users().get(user_id)
+        if user_data is None:
+            return None
+        return _projection(user_id, user_data)
 
-        for _, user_data in users.items():
-            # Get the color of the first role
-            user_roles = user_data.get("roles", [])
-            color = None
-            if user_roles:
-                first_role_name = user_roles[0]
-                first_role_data = roles.get_role(first_role_name)
-                if first_role_data:
-                    color = first_role_data.get("color")
-            user_data["color"] = color
+def get_users():
+    """
+    Get all users from the users database.
 
+    Returns:
+        list: The display projections of all users that are not banned.
+            The dicts are shared and must not be modified.
+    """
+    with _lock:
         user_arr = []
-        for user_id, user_data in users.items():
-            if "banned" in user_data.get("roles", []):
+        for user_id, user_data in _get_users().items():
+            projection = _projection(user_id, user_data)
+            if "banned" in projection["roles"]:
                 continue
-            user_arr.append({
-                "username": user_id,
-                "roles": user_data.get("roles", []),
-                "color": user_data.get("color")
-            })
+            user_arr.append(projection)
         return user_arr
-    except FileNotFoundError:
-        return []
-    
+
 def save_user(user_id, user_data):
     """
     Save user data to the users database.
     """
-    try:
-        with open(users_index, "r") as f:
-            users = json.load(f)
-    except FileNotFoundError:
-        users = {}
-
-    users[user_id] = user_data
+    with _lock:
+        users = _get_users()
+        if _roles_of(users.get(user_id)) != _roles_of(user_data):
+            _invalidate_roles()
+        users[user_id] = copy.deepcopy(user_data)
+        _mark_dirty(user_id)
 
-    with open(users_index, "w") as f:
-        json.dump(users, f, indent=4)
-    
 def get_banned_users():
     """
     Get a list of all banned users.
     """
-    try:
-        with open(users_index, "r") as f:
-            users_data = json.load(f)
-        
+    with _lock:
         banned_users = []
-        for user_id, user_data in users_data.items():
+        for user_id, user_data in _get_users().items():
             if "banned" in user_data.get("roles", []):
                 banned_users.append(user_id)
-        
+
         return banned_users
-    except FileNotFoundError:
-        return []
 
 def is_user_banned(user_id):
     """
     Check if a user is banned by checking if they have the 'banned' role.
     """
-    user = get_user(user_id)
-    if user and "banned" in user.get("roles", []):
-        return True
-    return False
+    return "banned" in get_user_roles(user_id)
 
 def ban_user(user_id):
     """
@@ -174,4 +380,4 @@ def remove_role(user_id, role):
         user["roles"].remove(role)
         save_user(user_id, user)
         return True
-    return False
\ No newline at end of file
+    return False
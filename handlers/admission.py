@@ -0,0 +1,94 @@
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import Logger
+
+class AdmissionController:
+    """
+    Decides whether a new connection may be accepted, before any work is done for it.
+
+    Limits the number of concurrent connections per client IP and the number of
+    connections that have not authenticated yet, and closes connections that
+    do not authenticate within 'auth_timeout' seconds. A limit of 0 disables it.
+    """
+
+    def __init__(self, max_per_ip=0, auth_timeout=30, max_pending_auth=1000):
+        self.max_per_ip = max_per_ip
+        self.auth_timeout = auth_timeout
+        self.max_pending_auth = max_pending_auth
+
+        # client ip -> number of open connections
+        self._per_ip = {}
+        # ws -> client ip
+        self._clients = {}
+        # ws -> auth deadline timer handle, for connections that have not authenticated yet
+        self._pending = {}
+        # Closes of connections that timed out, still in progress
+        self._close_tasks = set()
+
+        # Metrics
+        self.rejected_per_ip = 0
+        self.rejected_pending = 0
+        self.auth_timeouts = 0
+
+    def admit(self, ws, client_ip):
+        """
+        Register a new connection if the limits allow it.
+
+        Returns:
+            tuple: (close code, reason) if the connection must be refused, None if it was admitted.
+        """
+        if self.max_per_ip and self._per_ip.get(client_ip, 0) >= self.max_per_ip:
+            self.rejected_per_ip += 1
+            return 1008, "Too many connections from your address"
+        if self.max_pending_auth and len(self._pending) >= self.max_pending_auth:
+            self.rejected_pending += 1
+            return 1013, "Server busy, try again later"
+
+        self._per_ip[client_ip] = self._per_ip.get(client_ip, 0) + 1
+        self._clients[ws] = client_ip
+        handle = None
+        if self.auth_timeout:
+            handle = asyncio.get_running_loop().call_later(self.auth_timeout, self._auth_expired, ws)
+        self._pending[ws] = handle
+        return None
+
+    def authenticated(self, ws):
+        """Stop the auth deadline of a connection that has authenticated."""
+        handle = self._pending.pop(ws, None)
+        if handle is not None:
+            handle.cancel()
+
+    def release(self, ws):
+        """Forget a closed connection."""
+        self.authenticated(ws)
+        client_ip = self._clients.pop(ws, None)
+        if client_ip is None:
+            return
+        count = self._per_ip.get(client_ip, 0) - 1
+        if count > 0:
+            self._per_ip[client_ip] = count
+        else:
+            self._per_ip.pop(client_ip, None)
+
+    def _auth_expired(self, ws):
+        if self._pending.pop(ws, False) is False:
+            return  # Authenticated or released in the meantime
+        self.auth_timeouts += 1
+        Logger.warning(f"Client {self._clients.get(ws)} did not authenticate within {self.auth_timeout} seconds")
+        # Keep a reference so the close is not garbage collected before it finishes
+        task = asyncio.create_task(ws.close(code=1008, reason="Authentication timeout"))
+        self._close_tasks.add(task)
+        task.add_done_callback(self._close_tasks.discard)
+
+    def stats(self):
+        """Get the connection counts and rejection metrics."""
+        return {
+            "connections": len(self._clients),
+            "addresses": len(self._per_ip),
+            "pending_auth": len(self._pending),
+            "rejected_per_ip": self.rejected_per_ip,
+            "rejected_pending": self.rejected_pending,
+            "auth_timeouts": self.auth_timeouts
+        }
@@ -1,20 +1,29 @@
-import requests
-from db import users, roles
+from db import users
 from handlers.websocket_utils import send_to_client, broadcast_to_all
+from handlers.subscriptions import channel_subscriptions
+from handlers.rotur import RoturValidator
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from logger import Logger
 
+_default_validator = None
+
+def _get_validator(config_data, server_data):
+    """Get the server's shared Rotur validator, or a module-wide one built from the config"""
+    global _default_validator
+    if server_data and server_data.get("rotur"):
+        return server_data["rotur"]
+    if _default_validator is None:
+        _default_validator = RoturValidator(config_data["rotur"]["validate_url"], config_data["rotur"]["validate_key"])
+    return _default_validator
+
 async def handle_authentication(websocket, data, config_data, connected_clients, client_ip, server_data=None):
     """Handle user authentication"""
-    url = config_data["rotur"]["validate_url"]
-    key = "originChats-" + config_data["rotur"]["validate_key"]
     validator = data.get("validator")
     
-    # Validate with rotur service
-    response = requests.get(url, params={"key": key, "v": validator}, timeout=5)
-    if response.status_code != 200 or response.json().get("valid") != True:
+    # Validate with rotur service without blocking the event loop
+    if not isinstance(validator, str) or not await _get_validator(config_data, server_data).validate(validator):
         await send_to_client(websocket, {"cmd": "auth_error", "val": "Invalid authentication"})
         Logger.error(f"Client {client_ip} failed authentication")
         return False
@@ -46,29 +55,33 @@ async def handle_authentication(websocket, data, config_data, connected_clients,
         return False
 
     user["username"] = websocket.username
+    channel_subscriptions.add(websocket)
     await send_to_client(websocket, {
         "cmd": "ready",
         "user": user
     })
     
-    # Get the color of the first role for user_connect broadcast
-    user_roles = user.get("roles", [])
-    color = None
-    if user_roles:
-        first_role_name = user_roles[0]
-        first_role_data = roles.get_role(first_role_name)
-        if first_role_data:
-            color = first_role_data.get("color")
+    # Get the display color for the user_connect broadcast
+    projection = users.get_user_projection(websocket.username)
+    color = projection["color"] if projection else None
+    
+    # Only announce the user if this is their first socket anywhere, not another tab
+    presence = server_data.get("presence") if server_data else None
+    came_online = True
+    if presence is not None:
+        was_online = presence.is_online(websocket.username)
+        came_online = presence.connect(websocket) and not was_online
     
     # Broadcast user connection to all clients
-    await broadcast_to_all(connected_clients, {
-        "cmd": "user_connect",
-        "user": {
-            "username": websocket.username,
-            "roles": user.get("roles"),
-            "color": color
-        }
-    })
+    if came_online:
+        await broadcast_to_all(connected_clients, {
+            "cmd": "user_connect",
+            "user": {
+                "username": websocket.username,
+                "roles": user.get("roles"),
+                "color": color
+            }
+        })
     
     # Trigger user_connect event for plugins
     if server_data and "plugin_manager" in server_data:
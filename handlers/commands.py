@@ -0,0 +1,245 @@
+import sys
+import os
+from contextlib import contextmanager
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import users, channels
+from logger import Logger
+
+class CommandSpec:
+    """
+    Declares a client command and the checks run before its handler.
+
+    Args:
+        name (str): The "cmd" value the command is sent with.
+        handler: Called as handler(ctx, ws, message, server_data) and returns the response.
+            'ctx' is the sender's UserContext, or None for commands without 'auth'.
+        auth (bool): Whether the sender must be an existing, authenticated user.
+        args (dict): Required fields, name -> type. Missing, empty or mistyped fields are rejected with 'invalid'.
+        optional (dict): Optional fields, name -> type. Present fields of the wrong type are rejected
+            with "Invalid <name>".
+        invalid (str): Error returned for bad required arguments.
+        validate: Optional cheap check called as validate(message, server_data) before the rate limit is taken.
+            Returns an error message, or None if the message is valid.
+        rate_limit (dict): {"bucket", "cost"} the command takes from the sender's rate limits, or None.
+        role (str): Role the sender needs, or None.
+        permission (str): Permission the sender needs on the channel named by the "channel" field
+            ("view", "send" or "react"), or None.
+        denied (str): Error returned when 'permission' is missing.
+        offload (bool): Whether the command touches storage and should run off the event loop.
+    """
+    __slots__ = ("name", "handler", "auth", "args", "optional", "invalid", "validate", "rate_limit",
+                 "role", "permission", "denied", "offload", "owner")
+
+    def __init__(self, name, handler, auth=True, args=None, optional=None, invalid=None, validate=None,
+                 rate_limit=None, role=None, permission=None, denied="Access denied to this channel",
+                 offload=False):
+        if permission is not None and permission not in CHANNEL_PERMISSIONS:
+            raise ValueError(f"Command '{name}' needs unknown channel permission '{permission}'")
+        if (permission is not None or role is not None) and not auth:
+            raise ValueError(f"Command '{name}' checks the sender's roles, so it needs auth")
+        if permission is not None and "channel" not in (args or {}):
+            raise ValueError(f"Command '{name}' checks a channel permission, so it needs a 'channel' argument")
+        self.name = name
+        self.handler = handler
+        self.auth = auth
+        self.args = tuple((args or {}).items())
+        self.optional = tuple((optional or {}).items())
+        self.invalid = invalid or f"Invalid {name} format"
+        self.validate = validate
+        self.rate_limit = rate_limit
+        self.role = role
+        self.permission = permission
+        self.denied = denied
+        self.offload = offload
+        # Name of the plugin that registered the command, None for built-in commands
+        self.owner = None
+
+class UserContext:
+    """
+    The resolved sender of a command.
+
+    Cached on the connection and reused until user data or channel
+    permissions change, so commands do not look the user up again.
+    """
+    __slots__ = ("username", "roles", "version", "_viewable")
+
+    def __init__(self, username, roles, version):
+        self.username = username
+        self.roles = roles
+        self.version = version
+        self._viewable = None
+
+    def viewable_text_channels(self):
+        """Get the names of the text channels the user can view."""
+        if self._viewable is None:
+            self._viewable = frozenset(
+                c.get("name") for c in channels.get_all_channels_for_roles(list(self.roles)) if c.get("type") == "text"
+            )
+        return self._viewable
+
+# Channel permission name -> check(ctx, channel name)
+CHANNEL_PERMISSIONS = {
+    "view": lambda ctx, channel_name: channel_name in ctx.viewable_text_channels(),
+    "send": lambda ctx, channel_name: channels.does_user_have_permission(channel_name, list(ctx.roles), "send"),
+    "react": lambda ctx, channel_name: channels.can_user_react(channel_name, list(ctx.roles))
+}
+
+def _current_version():
+    return (users.get_version(), channels.get_permissions_version())
+
+def get_user_context(ws):
+    """
+    Get the cached context of an authenticated connection's user.
+
+    Returns:
+        UserContext: The context, or None if the connection is not authenticated or the user does not exist.
+    """
+    username = getattr(ws, "username", None)
+    if not username:
+        return None
+    version = _current_version()
+    ctx = getattr(ws, "command_context", None)
+    if ctx is not None and ctx.version == version and ctx.username == username:
+        return ctx
+    user_data = users.get_user(username)
+    if not user_data:
+        return None
+    ctx = UserContext(username, tuple(user_data.get("roles", [])), version)
+    ws.command_context = ctx
+    return ctx
+
+def _check_args(message, fields, required):
+    """Get the name of the first field that fails its check, or None."""
+    for name, expected in fields:
+        value = message.get(name)
+        if value is None:
+            if required:
+                return name
+        elif not isinstance(value, expected) or (required and not value):
+            return name
+    return None
+
+class CommandRegistry:
+    """
+    Dispatch table of client commands.
+
+    Each command's checks are declared once in its CommandSpec and run by the
+    dispatcher before the handler. Plugins add commands by defining
+    register_commands(registry) and calling registry.register().
+    """
+
+    def __init__(self):
+        self._specs = {}
+        self._owner = None
+
+    def register(self, spec):
+        """
+        Add a command.
+
+        Raises:
+            ValueError: If another command with the same name is registered.
+        """
+        if spec.name in self._specs:
+            raise ValueError(f"Command '{spec.name}' is already registered")
+        spec.owner = self._owner
+        self._specs[spec.name] = spec
+        return spec
+
+    def unregister(self, name):
+        """Remove a command."""
+        self._specs.pop(name, None)
+
+    def unregister_owner(self, owner):
+        """Remove every command registered by a plugin."""
+        for name in [name for name, spec in self._specs.items() if spec.owner == owner]:
+            self.unregister(name)
+
+    @contextmanager
+    def owned_by(self, owner):
+        """Attribute the commands registered inside the block to a plugin."""
+        self._owner = owner
+        try:
+            yield self
+        finally:
+            self._owner = None
+
+    def get(self, name):
+        """Get the spec of a command, or None."""
+        return self._specs.get(name)
+
+    def names(self):
+        """Get the names of all registered commands."""
+        return list(self._specs)
+
+    def check(self, ws, message, server_data=None):
+        """
+        Check a client message against its command's spec without running the handler.
+        The rate limit cost is only taken once every other check has passed, and must be
+        taken from the event loop.
+
+        Returns:
+            tuple: (spec, ctx, None) if the command may run, or (None, None, error response).
+        """
+        if not isinstance(message, dict):
+            return None, None, {"cmd": "error", "val": f"Invalid message format: expected a dictionary, got {type(message).__name__}"}
+
+        cmd = message.get("cmd")
+        spec = self._specs.get(cmd) if isinstance(cmd, str) else None
+        if spec is None:
+            return None, None, {"cmd": "error", "val": f"Unknown command: {cmd}"}
+        Logger.get(f"Received command: {cmd}")
+
+        ctx = None
+        if spec.auth:
+            if not getattr(ws, "username", None):
+                return None, None, {"cmd": "error", "val": "User not authenticated"}
+            ctx = get_user_context(ws)
+            if ctx is None:
+                return None, None, {"cmd": "error", "val": "User not found"}
+
+        if _check_args(message, spec.args, True) is not None:
+            return None, None, {"cmd": "error", "val": spec.invalid}
+        bad_field = _check_args(message, spec.optional, False)
+        if bad_field is not None:
+            return None, None, {"cmd": "error", "val": f"Invalid {bad_field}"}
+
+        if spec.validate:
+            error = spec.validate(message, server_data)
+            if error:
+                return None, None, {"cmd": "error", "val": error}
+
+        if spec.role and spec.role not in ctx.roles:
+            return None, None, {"cmd": "error", "val": f"Access denied: {spec.role} role required"}
+
+        if spec.permission and not CHANNEL_PERMISSIONS[spec.permission](ctx, message.get("channel")):
+            return None, None, {"cmd": "error", "val": spec.denied}
+
+        limiter = server_data.get("rate_limiter") if server_data else None
+        if spec.rate_limit and limiter and ctx is not None:
+            if spec.name not in limiter.commands:
+                try:
+                    limiter.add_command(spec.name, spec.rate_limit)
+                except ValueError as e:
+                    # Fall back to the default bucket rather than failing every call
+                    Logger.error(str(e))
+                    limiter.add_command(spec.name, {})
+            is_allowed, reason, wait_time = limiter.is_allowed(ctx.username, spec.name)
+            if not is_allowed:
+                # Convert wait time to milliseconds and send rate_limit packet
+                return None, None, {"cmd": "rate_limit", "length": int(wait_time * 1000)}
+
+        return spec, ctx, None
+
+    def dispatch(self, ws, message, server_data=None):
+        """
+        Check a client message against its command's spec and run the handler.
+
+        Returns:
+            dict: The response.
+        """
+        spec, ctx, error = self.check(ws, message, server_data)
+        if spec is None:
+            return error
+        return spec.handler(ctx, ws, message, server_data)
+
+command_registry = CommandRegistry()
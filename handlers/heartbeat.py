@@ -0,0 +1,89 @@
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import Logger
+from handlers.websocket_utils import encode_message, send_encoded
+
+# Every ping is the same frame, so it is encoded once
+PING_FRAME = encode_message({"cmd": "ping"})
+
+class HeartbeatScheduler:
+    """
+    Sends periodic pings to every connection from a single task.
+
+    Connections are spread over 'slots' buckets that are swept one after the
+    other, so each connection is pinged once per 'interval' seconds while the
+    pings to all connections are spread evenly across the interval instead of
+    arriving in one burst.
+    """
+
+    def __init__(self, interval=30, slots=30):
+        self.interval = interval
+        self.slots = max(1, slots)
+        self._buckets = [set() for _ in range(self.slots)]
+        # ws -> index of its bucket
+        self._slot_of = {}
+        self._cursor = 0
+        # Bucket the next connection goes into, so connections opened together are still spread out
+        self._next_slot = 0
+        self._task = None
+
+        # Metrics
+        self.pings_sent = 0
+
+    def add(self, ws):
+        """Start pinging a connection, first within one interval."""
+        if ws in self._slot_of:
+            return
+        # Round-robin over the buckets, independent of the sweep, so a reconnect storm lands in every bucket
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self.slots
+        self._buckets[slot].add(ws)
+        self._slot_of[ws] = slot
+
+    def remove(self, ws):
+        """Stop pinging a connection."""
+        slot = self._slot_of.pop(ws, None)
+        if slot is not None:
+            self._buckets[slot].discard(ws)
+
+    async def _sweep(self, slot):
+        for ws in list(self._buckets[slot]):
+            if await send_encoded(ws, PING_FRAME):
+                self.pings_sent += 1
+            else:
+                self.remove(ws)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        tick = self.interval / self.slots
+        next_tick = loop.time() + tick
+        while True:
+            # Sleep until an absolute deadline so slow sweeps do not make the interval drift
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+            next_tick += tick
+            slot = self._cursor
+            self._cursor = (self._cursor + 1) % self.slots
+            try:
+                await self._sweep(slot)
+            except Exception as e:
+                Logger.error(f"Heartbeat error: {str(e)}")
+
+    def start(self):
+        """Start the scheduler task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Stop the scheduler task."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        """Get the number of connections being pinged and pings sent."""
+        return {
+            "connections": len(self._slot_of),
+            "pings_sent": self.pings_sent
+        }
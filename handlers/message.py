@@ -1,460 +1,275 @@
-from db import channels, users, roles
+from db import channels, users
 import time
 import uuid
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from logger import Logger
+from handlers.commands import CommandSpec, command_registry
+from handlers.rate_limiter import DEFAULT_COMMANDS
 
 def handle(ws, message, server_data=None):
     """
     Handle incoming messages from clients.
     This function should be called when a new message is received.
-    
+
     Args:
         ws: WebSocket connection
         message: Message data from client
         server_data: Dict containing server state (connected_clients, etc.)
     """
-    if True:
-        # Process the message here
-        Logger.get(f"Received message: {message}")
-
-        if not isinstance(message, dict):
-            return {"cmd": "error", "val": f"Invalid message format: expected a dictionary, got {type(message).__name__}"}
-
-        match_cmd = message.get("cmd")
-        match match_cmd:
-            case "ping":
-                # Handle ping command
-                return {"cmd": "pong", "val": "pong"}
-            case "message_new":
-                if server_data is None:
-                    return {"cmd": "error", "val": "Server data not available"}
-                # Handle chat message
-                channel_name = message.get("channel")
-                content = message.get("content")
-                reply_to = message.get("reply_to")  # Optional: ID of message being replied to
-                user = getattr(ws, 'username', None)
-
-                if not channel_name or not content or not user:
-                    return {"cmd": "error", "val": "Invalid chat message format"}
-
-                content = content.strip()
-                if not content:
-                    return {"cmd": "error", "val": "Message content cannot be empty"}
-
-                # Check message length limit from config
-                max_length = server_data.get("config", {}).get("limits", {}).get("post_content", 2000)
-                if len(content) > max_length:
-                    return {"cmd": "error", "val": f"Message too long. Maximum length is {max_length} characters"}
-
-                # Check rate limiting if enabled
-                if server_data and server_data.get("rate_limiter"):
-                    is_allowed, reason, wait_time = server_data["rate_limiter"].is_allowed(user)
-                    if not is_allowed:
-                        # Convert wait time to milliseconds and send rate_limit packet
-                        wait_time_ms = int(wait_time * 1000)
-                        return {"cmd": "rate_limit", "length": wait_time_ms}
-
-                user_roles = users.get_user_roles(user)
-                if not user_roles:
-                    return {"cmd": "error", "val": "User roles not found"}
-
-                # Check if the user has permission to send messages in this channel
-                if not channels.does_user_have_permission(channel_name, user_roles, "send"):
-                    return {"cmd": "error", "val": "You do not have permission to send messages in this channel"}
-
-                # Validate reply_to if provided
-                replied_message = None
-                if reply_to:
-                    replied_message = channels.get_channel_message(channel_name, reply_to)
-                    if not replied_message:
-                        return {"cmd": "error", "val": "The message you're trying to reply to was not found"}
-
-                # Save the message to the channel
-                out_msg = {
-                    "user": user,
-                    "content": content,
-                    "timestamp": time.time(),  # Use current timestamp
-                    "type": "message",
-                    "pinned": False,
-                    "id": str(uuid.uuid4())
-                }
-
-                # Add reply information if this is a reply
-                if reply_to and replied_message:
-                    out_msg["reply_to"] = {
-                        "id": reply_to,
-                        "user": replied_message.get("user")
-                    }
-
-                channels.save_channel_message(channel_name, out_msg)
-
-                # Trigger new_message event for plugins
-                if server_data and "plugin_manager" in server_data:
-                    server_data["plugin_manager"].trigger_event("new_message", ws, {
-                        "content": content,
-                        "channel": channel_name,
-                        "user": user,
-                        "message": out_msg
-                    }, server_data)
-
-                # Optionally broadcast to all clients
-                return {"cmd": "message_new", "message": out_msg, "channel": channel_name, "global": True}
-            case "typing":
-                # Handle typing
-                user = getattr(ws, 'username', None)
-                if not user:
-                    return {"cmd": "error", "val": "User not authenticated"}
-
-                # Check rate limiting if enabled
-                if server_data and server_data.get("rate_limiter"):
-                    is_allowed, reason, wait_time = server_data["rate_limiter"].is_allowed(user)
-                    if not is_allowed:
-                        # Convert wait time to milliseconds and send rate_limit packet
-                        return {"cmd": "rate_limit", "val": reason, "wait_time": wait_time}
-
-                channel_name = message.get("channel")
-                if not channel_name:
-                    return {"cmd": "error", "val": "Channel name not provided"}
-                
-                if server_data and "plugin_manager" in server_data:
-                    server_data["plugin_manager"].trigger_event("typing", ws, {
-                        "user": user,
-                        "channel": channel_name
-                    }, server_data)
-
-                return {"cmd": "typing", "user": user, "channel": channel_name, "global": True}
-            case "message_edit":
-                # Handle message edit
-                user = getattr(ws, 'username', None)
-                if not user:
-                    return {"cmd": "error", "val": "User not authenticated"}
-                # Check rate limiting if enabled
-                if server_data and server_data.get("rate_limiter"):
-                    is_allowed, reason, wait_time = server_data["rate_limiter"].is_allowed(user)
-                    if not is_allowed:
-                        # Convert wait time to milliseconds and send rate_limit packet
-                        wait_time_ms = int(wait_time * 1000)
-                        return {"cmd": "rate_limit", "length": wait_time_ms}
-                message_id = message.get("id")
-                channel_name = message.get("channel")
-                new_content = message.get("content")
-                if not message_id or not channel_name or not new_content:
-                    return {"cmd": "error", "val": "Invalid message edit format"}
-                # Check if the message exists
-                msg_obj = channels.get_channel_message(channel_name, message_id)
-                if not msg_obj:
-                    return {"cmd": "error", "val": "Message not found or cannot be edited"}
-                user_roles = users.get_user_roles(user)
-                if not user_roles:
-                    return {"cmd": "error", "val": "User roles not found"}
-                if msg_obj.get("user") == user:
-                    # Editing own message
-                    if not channels.can_user_edit_own(channel_name, user_roles):
-                        return {"cmd": "error", "val": "You do not have permission to edit your own message in this channel"}
-                else:
-                    # Editing someone else's message (future: add edit permission if needed)
-                    return {"cmd": "error", "val": "You do not have permission to edit this message"}
-                if not channels.edit_channel_message(channel_name, message_id, new_content):
-                    return {"cmd": "error", "val": "Failed to edit message"}
-                return {"cmd": "message_edit", "id": message_id, "content": new_content, "channel": channel_name, "global": True}
-            case "message_delete":
-                # Handle message delete
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "User not authenticated"}
-                
-                message_id = message.get("id")
-                channel_name = message.get("channel")
-                if not message_id or not channel_name:
-                    return {"cmd": "error", "val": "Invalid message delete format"}
-
-                # Check if the message exists and can be deleted
-                message = channels.get_channel_message(channel_name, message_id)
-                if not message:
-                    return {"cmd": "error", "val": "Message not found or cannot be deleted"}
-                
-                user_roles = users.get_user_roles(username)
-                if not user_roles:
-                    return {"cmd": "error", "val": "User roles not found"}
-                
-
-                if message.get("user") == username:
-                    # User is deleting their own message
-                    if not channels.can_user_delete_own(channel_name, user_roles):
-                        return {"cmd": "error", "val": "You do not have permission to delete your own message in this channel"}
-                else:
-                    # User is deleting someone else's message
-                    if not channels.does_user_have_permission(channel_name, user_roles, "delete"):
-                        return {"cmd": "error", "val": "You do not have permission to delete this message"}
-
-                if not channels.delete_channel_message(channel_name, message_id):
-                    return {"cmd": "error", "val": "Failed to delete message"}
-                return {"cmd": "message_delete", "id": message_id, "channel": channel_name, "global": True}
-            case "message_react_add":
-                # Handle request to add a reaction to a message
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "Authentication required"}
-
-                user_roles = users.get_user_roles(username)
-                if not user_roles:
-                    return {"cmd": "error", "val": "User roles not found"}
-
-                channel_name = message.get("channel")
-                # Check if the user has permission to add reactions
-                if not channels.can_user_react(channel_name, user_roles):
-                    return {"cmd": "error", "val": "You do not have permission to add reactions to this message"}
-
-                message_id = message.get("id")
-                if not message_id:
-                    return {"cmd": "error", "val": "Message ID is required"}
-
-                emoji = message.get("emoji")
-                if not emoji:
-                    return {"cmd": "error", "val": "Emoji is required"}
-
-                if not channels.add_reaction(channel_name, message_id, emoji, username):
-                    return {"cmd": "error", "val": "Failed to add reaction"}
-                return {"cmd": "message_react_add", "id": message_id, "emoji": emoji, "channel": channel_name, "from": username, "global": True}
-            case "message_react_remove":
-                # Handle request to remove a reaction from a message
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "Authentication required"}
-
-                channel_name = message.get("channel")
-
-                user_roles = users.get_user_roles(username)
-                if not user_roles:
-                    return {"cmd": "error", "val": "User roles not found"}
-
-                # Check if the user has permission to remove reactions
-                if not channels.can_user_react(channel_name, user_roles):
-                    return {"cmd": "error", "val": "You do not have permission to remove reactions from this message"}
-
-                message_id = message.get("id")
-                if not message_id:
-                    return {"cmd": "error", "val": "Message ID is required"}
-
-                emoji = message.get("emoji")
-                if not emoji:
-                    return {"cmd": "error", "val": "Emoji is required"}
-
-                if not channels.remove_reaction(channel_name, message_id, emoji, username):
-                    return {"cmd": "error", "val": "Failed to remove reaction"}
-                return {"cmd": "message_react_remove", "id": message_id, "emoji": emoji, "channel": channel_name, "from": username, "global": True}
-            case "messages_get":
-                # Handle request for channel messages
-                channel_name = message.get("channel")
-                limit = message.get("limit", 100)
-
-                if not channel_name:
-                    return {"cmd": "error", "val": "Invalid channel name"}
-
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "User not authenticated"}
-
-                user_data = users.get_user(username)
-                if not user_data:
-                    return {"cmd": "error", "val": "User not found"}
-
-                # Check if user can see this channel
-                allowed_channels = channels.get_all_channels_for_roles(user_data.get("roles", []))
-
-                if channel_name not in [c.get("name") for c in allowed_channels if c.get("type") == "text"]:
-                    return {"cmd": "error", "val": "Access denied to this channel"}
-
-                messages = channels.get_channel_messages(channel_name, limit)
-                return {"cmd": "messages_get", "channel": channel_name, "messages": messages}
-            case "message_get":
-                # Handle request for a specific message by ID
-                channel_name = message.get("channel")
-                message_id = message.get("id")
-
-                if not channel_name or not message_id:
-                    return {"cmd": "error", "val": "Channel name and message ID are required"}
-
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "User not authenticated"}
-
-                user_data = users.get_user(username)
-                if not user_data:
-                    return {"cmd": "error", "val": "User not found"}
-
-                # Check if user can see this channel
-                allowed_channels = channels.get_all_channels_for_roles(user_data.get("roles", []))
-
-                if channel_name not in [c.get("name") for c in allowed_channels if c.get("type") == "text"]:
-                    return {"cmd": "error", "val": "Access denied to this channel"}
-
-                # Get the specific message
-                msg = channels.get_channel_message(channel_name, message_id)
-                if not msg:
-                    return {"cmd": "error", "val": "Message not found"}
-
-                return {"cmd": "message_get", "channel": channel_name, "message": msg}
-            case "message_replies":
-                # Handle request for replies to a specific message
-                channel_name = message.get("channel")
-                message_id = message.get("id")
-                limit = message.get("limit", 50)
-
-                if not channel_name or not message_id:
-                    return {"cmd": "error", "val": "Channel name and message ID are required"}
-
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "User not authenticated"}
-
-                user_data = users.get_user(username)
-                if not user_data:
-                    return {"cmd": "error", "val": "User not found"}
-
-                # Check if user can see this channel
-                allowed_channels = channels.get_all_channels_for_roles(user_data.get("roles", []))
-
-                if channel_name not in [c.get("name") for c in allowed_channels if c.get("type") == "text"]:
-                    return {"cmd": "error", "val": "Access denied to this channel"}
-
-                # Get replies to the message
-                replies = channels.get_message_replies(channel_name, message_id, limit)
-                return {"cmd": "message_replies", "channel": channel_name, "message_id": message_id, "replies": replies}
-            case "channels_get":
-                # Handle request for available channels
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "User not authenticated"}
-                    
-                user_data = users.get_user(username)  # Ensure user exists
-                if not user_data:
-                    return {"cmd": "error", "val": "User not found"}
-                channels_list = channels.get_all_channels_for_roles(user_data.get("roles", []))
-                return {"cmd": "channels_get", "val": channels_list}
-            case "users_list":
-                # Handle request for all users list
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "User not authenticated"}
-                
-                users_list = users.get_users()
-                return {"cmd": "users_list", "users": users_list}
-            case "users_online":
-                # Handle request for online users list  
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "User not authenticated"}
-                
-                if not server_data or "connected_clients" not in server_data:
-                    return {"cmd": "error", "val": "Server data not available"}
-                
-                # Gather authenticated users' info efficiently
-                online_users = []
-                for client_ws in server_data["connected_clients"]:
-                    if getattr(client_ws, "authenticated", False):
-                        user_data = users.get_user(client_ws.username)
-                        if not user_data:
-                            continue
-                        
-                        # Get the color of the first role
-                        user_roles = user_data.get("roles", [])
-                        color = None
-                        if user_roles:
-                            first_role_name = user_roles[0]
-                            first_role_data = roles.get_role(first_role_name)
-                            if first_role_data:
-                                color = first_role_data.get("color")
-                        
-                        online_users.append({
-                            "username": client_ws.username,
-                            "roles": user_data.get("roles"),
-                            "color": color
-                        })
-                
-                return {"cmd": "users_online", "users": online_users}
-            case "plugins_list":
-                # Handle request for loaded plugins (admin only)
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "User not authenticated"}
-                
-                user_roles = users.get_user_roles(username)
-                if not user_roles or "owner" not in user_roles:
-                    return {"cmd": "error", "val": "Access denied: owner role required"}
-                
-                if not server_data or "plugin_manager" not in server_data:
-                    return {"cmd": "error", "val": "Plugin manager not available"}
-                
-                plugins = server_data["plugin_manager"].get_loaded_plugins()
-                return {"cmd": "plugins_list", "plugins": plugins}
-            case "plugins_reload":
-                # Handle request to reload plugins (admin only)
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "User not authenticated"}
-                
-                user_roles = users.get_user_roles(username)
-                if not user_roles or "owner" not in user_roles:
-                    return {"cmd": "error", "val": "Access denied: owner role required"}
-                
-                if not server_data or "plugin_manager" not in server_data:
-                    return {"cmd": "error", "val": "Plugin manager not available"}
-                
-                plugin_name = message.get("plugin")
-                if plugin_name:
-                    # Reload specific plugin
-                    success = server_data["plugin_manager"].reload_plugin(plugin_name)
-                    if success:
-                        return {"cmd": "plugins_reload", "val": f"Plugin '{plugin_name}' reloaded successfully"}
-                    else:
-                        return {"cmd": "error", "val": f"Failed to reload plugin '{plugin_name}'"}
-                else:
-                    # Reload all plugins
-                    server_data["plugin_manager"].reload_all_plugins()
-                    return {"cmd": "plugins_reload", "val": "All plugins reloaded successfully"}
-            case "rate_limit_status":
-                # Handle request for rate limit status (admin or self)
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "User not authenticated"}
-                
-                target_user = message.get("user", username)  # Default to self
-                user_roles = users.get_user_roles(username)
-                
-                # Allow users to check their own status, or admins to check anyone's
-                if target_user != username and (not user_roles or "owner" not in user_roles):
-                    return {"cmd": "error", "val": "Access denied: can only check your own rate limit status"}
-                
-                if not server_data or not server_data.get("rate_limiter"):
-                    return {"cmd": "error", "val": "Rate limiter not available or disabled"}
-                
-                status = server_data["rate_limiter"].get_user_status(target_user)
-                return {"cmd": "rate_limit_status", "user": target_user, "status": status}
-            case "rate_limit_reset":
-                # Handle request to reset rate limit for a user (admin only)
-                username = getattr(ws, 'username', None)
-                if not username:
-                    return {"cmd": "error", "val": "User not authenticated"}
-                
-                user_roles = users.get_user_roles(username)
-                if not user_roles or "owner" not in user_roles:
-                    return {"cmd": "error", "val": "Access denied: owner role required"}
-                
-                target_user = message.get("user")
-                if not target_user:
-                    return {"cmd": "error", "val": "User parameter is required"}
-                
-                if not server_data or not server_data.get("rate_limiter"):
-                    return {"cmd": "error", "val": "Rate limiter not available or disabled"}
-                
-                server_data["rate_limiter"].reset_user(target_user)
-                return {"cmd": "rate_limit_reset", "user": target_user, "val": f"Rate limit reset for user {target_user}"}
-            case _:
-                return {"cmd": "error", "val": f"Unknown command: {message.get('cmd')}"}
-    # except Exception as e:
-    #    print(f"[OriginChatsWS] Error handling message: {str(e)}")
-    #    return {"cmd": "error", "val": f"Exception: {str(e)}"}
\ No newline at end of file
+    return command_registry.dispatch(ws, message, server_data)
+
+# Built-in commands. Authentication, arguments, rate limits, roles and channel
+# permissions are checked by the dispatcher from each command's spec.
+
+def _ping(ctx, ws, message, server_data):
+    return {"cmd": "pong", "val": "pong"}
+
+def _validate_message_new(message, server_data):
+    if server_data is None:
+        return "Server data not available"
+    content = message["content"].strip()
+    if not content:
+        return "Message content cannot be empty"
+
+    # Check message length limit from config
+    max_length = server_data.get("config", {}).get("limits", {}).get("post_content", 2000)
+    if len(content) > max_length:
+        return f"Message too long. Maximum length is {max_length} characters"
+    return None
+
+def _message_new(ctx, ws, message, server_data):
+    channel_name = message["channel"]
+    reply_to = message.get("reply_to")  # Optional: ID of message being replied to
+    user = ctx.username
+    content = message["content"].strip()
+
+    # Validate reply_to if provided
+    replied_message = None
+    if reply_to:
+        replied_message = channels.get_channel_message(channel_name, reply_to)
+        if not replied_message:
+            return {"cmd": "error", "val": "The message you're trying to reply to was not found"}
+
+    # Save the message to the channel
+    out_msg = {
+        "user": user,
+        "content": content,
+        "timestamp": time.time(),  # Use current timestamp
+        "type": "message",
+        "pinned": False,
+        "id": str(uuid.uuid4())
+    }
+
+    # Add reply information if this is a reply
+    if reply_to and replied_message:
+        out_msg["reply_to"] = {
+            "id": reply_to,
+            "user": replied_message.get("user")
+        }
+
+    channels.save_channel_message(channel_name, out_msg)
+
+    # Trigger new_message event for plugins
+    if "plugin_manager" in server_data:
+        server_data["plugin_manager"].trigger_event("new_message", ws, {
+            "content": content,
+            "channel": channel_name,
+            "user": user,
+            "message": out_msg
+        }, server_data)
+
+    # Optionally broadcast to all clients
+    return {"cmd": "message_new", "message": out_msg, "channel": channel_name, "global": True}
+
+def _typing(ctx, ws, message, server_data):
+    channel_name = message["channel"]
+    if server_data and "plugin_manager" in server_data:
+        server_data["plugin_manager"].trigger_event("typing", ws, {
+            "user": ctx.username,
+            "channel": channel_name
+        }, server_data)
+
+    return {"cmd": "typing", "user": ctx.username, "channel": channel_name, "global": True}
+
+def _message_edit(ctx, ws, message, server_data):
+    message_id = message["id"]
+    channel_name = message["channel"]
+    new_content = message["content"]
+    # Check if the message exists
+    msg_obj = channels.get_channel_message(channel_name, message_id)
+    if not msg_obj:
+        return {"cmd": "error", "val": "Message not found or cannot be edited"}
+    if msg_obj.get("user") == ctx.username:
+        # Editing own message
+        if not channels.can_user_edit_own(channel_name, list(ctx.roles)):
+            return {"cmd": "error", "val": "You do not have permission to edit your own message in this channel"}
+    else:
+        # Editing someone else's message (future: add edit permission if needed)
+        return {"cmd": "error", "val": "You do not have permission to edit this message"}
+    if not channels.edit_channel_message(channel_name, message_id, new_content):
+        return {"cmd": "error", "val": "Failed to edit message"}
+    return {"cmd": "message_edit", "id": message_id, "content": new_content, "channel": channel_name, "global": True}
+
+def _message_delete(ctx, ws, message, server_data):
+    message_id = message["id"]
+    channel_name = message["channel"]
+
+    # Check if the message exists and can be deleted
+    msg_obj = channels.get_channel_message(channel_name, message_id)
+    if not msg_obj:
+        return {"cmd": "error", "val": "Message not found or cannot be deleted"}
+
+    if msg_obj.get("user") == ctx.username:
+        # User is deleting their own message
+        if not channels.can_user_delete_own(channel_name, list(ctx.roles)):
+            return {"cmd": "error", "val": "You do not have permission to delete your own message in this channel"}
+    else:
+        # User is deleting someone else's message
+        if not channels.does_user_have_permission(channel_name, list(ctx.roles), "delete"):
+            return {"cmd": "error", "val": "You do not have permission to delete this message"}
+
+    if not channels.delete_channel_message(channel_name, message_id):
+        return {"cmd": "error", "val": "Failed to delete message"}
+    return {"cmd": "message_delete", "id": message_id, "channel": channel_name, "global": True}
+
+def _message_react_add(ctx, ws, message, server_data):
+    channel_name = message["channel"]
+    message_id = message["id"]
+    emoji = message["emoji"]
+    if not channels.add_reaction(channel_name, message_id, emoji, ctx.username):
+        return {"cmd": "error", "val": "Failed to add reaction"}
+    return {"cmd": "message_react_add", "id": message_id, "emoji": emoji, "channel": channel_name, "from": ctx.username, "global": True}
+
+def _message_react_remove(ctx, ws, message, server_data):
+    channel_name = message["channel"]
+    message_id = message["id"]
+    emoji = message["emoji"]
+    if not channels.remove_reaction(channel_name, message_id, emoji, ctx.username):
+        return {"cmd": "error", "val": "Failed to remove reaction"}
+    return {"cmd": "message_react_remove", "id": message_id, "emoji": emoji, "channel": channel_name, "from": ctx.username, "global": True}
+
+def _messages_get(ctx, ws, message, server_data):
+    channel_name = message["channel"]
+    messages = channels.get_channel_messages(channel_name, message.get("limit", 100))
+    return {"cmd": "messages_get", "channel": channel_name, "messages": messages}
+
+def _message_get(ctx, ws, message, server_data):
+    channel_name = message["channel"]
+    msg = channels.get_channel_message(channel_name, message["id"])
+    if not msg:
+        return {"cmd": "error", "val": "Message not found"}
+    return {"cmd": "message_get", "channel": channel_name, "message": msg}
+
+def _message_replies(ctx, ws, message, server_data):
+    channel_name = message["channel"]
+    message_id = message["id"]
+    replies = channels.get_message_replies(channel_name, message_id, message.get("limit", 50))
+    return {"cmd": "message_replies", "channel": channel_name, "message_id": message_id, "replies": replies}
+
+def _channels_get(ctx, ws, message, server_data):
+    channels_list = channels.get_all_channels_for_roles(list(ctx.roles))
+    return {"cmd": "channels_get", "val": channels_list}
+
+def _users_list(ctx, ws, message, server_data):
+    return {"cmd": "users_list", "users": users.get_users()}
+
+def _users_online(ctx, ws, message, server_data):
+    if not server_data or "presence" not in server_data:
+        return {"cmd": "error", "val": "Server data not available"}
+    # The presence registry keeps the online users' projections ready
+    return {"cmd": "users_online", "users": server_data["presence"].online()}
+
+def _plugins_list(ctx, ws, message, server_data):
+    if not server_data or "plugin_manager" not in server_data:
+        return {"cmd": "error", "val": "Plugin manager not available"}
+    plugins = server_data["plugin_manager"].get_loaded_plugins()
+    return {"cmd": "plugins_list", "plugins": plugins}
+
+def _plugins_reload(ctx, ws, message, server_data):
+    if not server_data or "plugin_manager" not in server_data:
+        return {"cmd": "error", "val": "Plugin manager not available"}
+
+    plugin_name = message.get("plugin")
+    if plugin_name:
+        # Reload specific plugin
+        if server_data["plugin_manager"].reload_plugin(plugin_name):
+            return {"cmd": "plugins_reload", "val": f"Plugin '{plugin_name}' reloaded successfully"}
+        return {"cmd": "error", "val": f"Failed to reload plugin '{plugin_name}'"}
+    # Reload all plugins
+    server_data["plugin_manager"].reload_all_plugins()
+    return {"cmd": "plugins_reload", "val": "All plugins reloaded successfully"}
+
+def _rate_limit_status(ctx, ws, message, server_data):
+    target_user = message.get("user", ctx.username)  # Default to self
+
+    # Allow users to check their own status, or admins to check anyone's
+    if target_user != ctx.username and "owner" not in ctx.roles:
+        return {"cmd": "error", "val": "Access denied: can only check your own rate limit status"}
+
+    if not server_data or not server_data.get("rate_limiter"):
+        return {"cmd": "error", "val": "Rate limiter not available or disabled"}
+
+    status = server_data["rate_limiter"].get_user_status(target_user)
+    return {"cmd": "rate_limit_status", "user": target_user, "status": status}
+
+def _rate_limit_reset(ctx, ws, message, server_data):
+    target_user = message["user"]
+    if not server_data or not server_data.get("rate_limiter"):
+        return {"cmd": "error", "val": "Rate limiter not available or disabled"}
+
+    server_data["rate_limiter"].reset_user(target_user)
+    # Every worker keeps its own copy of the limits
+    if server_data.get("bus"):
+        server_data["bus"].publish({"type": "rate_limit_reset", "user": target_user})
+    return {"cmd": "rate_limit_reset", "user": target_user, "val": f"Rate limit reset for user {target_user}"}
+
+for _spec in (
+    CommandSpec("ping", _ping, auth=False),
+    CommandSpec("message_new", _message_new,
+                args={"channel": str, "content": str}, optional={"reply_to": str},
+                invalid="Invalid chat message format", validate=_validate_message_new,
+                rate_limit=DEFAULT_COMMANDS["message_new"],
+                permission="send", denied="You do not have permission to send messages in this channel",
+                offload=True),
+    CommandSpec("typing", _typing,
+                args={"channel": str}, invalid="Channel name not provided",
+                rate_limit=DEFAULT_COMMANDS["typing"]),
+    CommandSpec("message_edit", _message_edit,
+                args={"id": str, "channel": str, "content": str},
+                invalid="Invalid message edit format", rate_limit=DEFAULT_COMMANDS["message_edit"],
+                permission="view", offload=True),
+    CommandSpec("message_delete", _message_delete,
+                args={"id": str, "channel": str}, invalid="Invalid message delete format",
+                permission="view", offload=True),
+    CommandSpec("message_react_add", _message_react_add,
+                args={"channel": str, "id": str, "emoji": str},
+                invalid="Channel, message ID and emoji are required", rate_limit=DEFAULT_COMMANDS["message_react_add"],
+                permission="react", denied="You do not have permission to add reactions to this message",
+                offload=True),
+    CommandSpec("message_react_remove", _message_react_remove,
+                args={"channel": str, "id": str, "emoji": str},
+                invalid="Channel, message ID and emoji are required", rate_limit=DEFAULT_COMMANDS["message_react_remove"],
+                permission="react", denied="You do not have permission to remove reactions from this message",
+                offload=True),
+    CommandSpec("messages_get", _messages_get,
+                args={"channel": str}, optional={"limit": int},
+                invalid="Invalid channel name", rate_limit=DEFAULT_COMMANDS["messages_get"],
+                permission="view", offload=True),
+    CommandSpec("message_get", _message_get,
+                args={"channel": str, "id": str}, invalid="Channel name and message ID are required",
+                permission="view", offload=True),
+    CommandSpec("message_replies", _message_replies,
+                args={"channel": str, "id": str}, optional={"limit": int},
+                invalid="Channel name and message ID are required", rate_limit=DEFAULT_COMMANDS["message_replies"],
+                permission="view", offload=True),
+    CommandSpec("channels_get", _channels_get, offload=True),
+    CommandSpec("users_list", _users_list, offload=True),
+    CommandSpec("users_online", _users_online),
+    CommandSpec("plugins_list", _plugins_list, role="owner"),
+    CommandSpec("plugins_reload", _plugins_reload, optional={"plugin": str}, role="owner"),
+    CommandSpec("rate_limit_status", _rate_limit_status, optional={"user": str}),
+    CommandSpec("rate_limit_reset", _rate_limit_reset,
+                args={"user": str}, invalid="User parameter is required", role="owner"),
+):
+    command_registry.register(_spec)
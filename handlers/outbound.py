@@ -0,0 +1,135 @@
+import asyncio, websockets
+from collections import deque
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import Logger
+
+class ClientOutbox:
+    """Bounded outbound queue for one connection, drained by its own writer task"""
+
+    def __init__(self, ws, manager):
+        self.ws = ws
+        self.manager = manager
+        self.closed = False
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def put(self, frame, droppable=False):
+        """
+        Queue a frame without blocking.
+
+        Returns:
+            bool: False if the connection is closed or was just dropped as a slow consumer.
+        """
+        if self.closed:
+            return False
+
+        depth = len(self._queue)
+        if droppable and depth >= self.manager.drop_ephemeral_at:
+            # Ephemeral events are the first thing a lagging client loses
+            self.manager.dropped += 1
+            return True
+        if depth >= self.manager.max_queue:
+            if self.manager.slow_consumer_policy == "drop":
+                self.manager.dropped += 1
+                return True
+            self._disconnect_slow_consumer()
+            return False
+
+        self._queue.append(frame)
+        self.manager.max_depth = max(self.manager.max_depth, depth + 1)
+        self._idle.clear()
+        self._wakeup.set()
+        return True
+
+    def _disconnect_slow_consumer(self):
+        Logger.warning(f"Disconnecting slow consumer {getattr(self.ws, 'username', None) or self.ws.remote_address}: {len(self._queue)} frames queued")
+        self.manager.disconnected += 1
+        self.close()
+        # Keep a reference so the close is not garbage collected before it finishes
+        task = asyncio.create_task(self.ws.close(code=1008, reason="Slow consumer"))
+        self.manager.close_tasks.add(task)
+        task.add_done_callback(self.manager.close_tasks.discard)
+
+    async def _run(self):
+        try:
+            while not self.closed:
+                while self._queue:
+                    await self.ws.send(self._queue.popleft())
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+        except asyncio.CancelledError:
+            pass
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            Logger.error(f"Error in client writer: {str(e)}")
+        finally:
+            self.closed = True
+            self._queue.clear()
+            self._idle.set()
+
+    async def drain(self, timeout=1):
+        """Wait until every queued frame has been written, or the timeout expires."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def close(self):
+        """Stop the writer task and discard anything still queued."""
+        self.closed = True
+        self._queue.clear()
+        self._idle.set()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+
+class OutboundManager:
+    """Creates client outboxes and keeps the slow-consumer policy and queue metrics"""
+
+    def __init__(self, max_queue=1000, drop_ephemeral_at=100, slow_consumer_policy="disconnect"):
+        self.max_queue = max_queue
+        self.drop_ephemeral_at = drop_ephemeral_at
+        self.slow_consumer_policy = slow_consumer_policy
+        self.outboxes = {}
+        # Closes of slow consumers still in progress
+        self.close_tasks = set()
+
+        # Metrics
+        self.max_depth = 0
+        self.dropped = 0
+        self.disconnected = 0
+
+    def attach(self, ws):
+        """Give a connection its outbox and writer task."""
+        outbox = ClientOutbox(ws, self)
+        ws.outbox = outbox
+        self.outboxes[ws] = outbox
+        return outbox
+
+    def detach(self, ws):
+        """Stop a connection's writer task."""
+        outbox = self.outboxes.pop(ws, None)
+        if outbox is not None:
+            outbox.close()
+
+    def stats(self):
+        """Get the queue depth and slow-consumer metrics."""
+        depths = [outbox.depth for outbox in self.outboxes.values()]
+        return {
+            "clients": len(depths),
+            "queued": sum(depths),
+            "deepest_queue": max(depths, default=0),
+            "max_depth_seen": self.max_depth,
+            "dropped": self.dropped,
+            "disconnected": self.disconnected
+        }
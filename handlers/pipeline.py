@@ -0,0 +1,160 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Plugins can register any number of commands, so only this many get their own metrics
+MAX_TRACKED_COMMANDS = 128
+
+class _Lane:
+    """Serializes the jobs of one channel"""
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+class _CommandMetrics:
+    """Queue wait and execution time of one command"""
+    __slots__ = ("count", "offloaded", "wait_total", "wait_max", "exec_total", "exec_max")
+
+    def __init__(self):
+        self.count = 0
+        self.offloaded = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.exec_total = 0.0
+        self.exec_max = 0.0
+
+    def record(self, wait, duration):
+        self.count += 1
+        self.wait_total += wait
+        self.exec_total += duration
+        if wait > self.wait_max:
+            self.wait_max = wait
+        if duration > self.exec_max:
+            self.exec_max = duration
+
+class CommandPipeline:
+    """
+    Runs client commands without blocking the event loop on storage.
+
+    A command's checks (authentication, arguments, rate limit, role and
+    permission) run on the event loop. Handlers of commands whose spec sets
+    'offload' then run on a bounded thread pool. Commands naming a
+    channel are serialized per channel, so writes land in the order they were
+    received while different channels proceed in parallel. Other commands run
+    inline on the event loop. Queue wait and execution time are recorded per
+    command.
+    """
+
+    def __init__(self, registry, workers=4):
+        self.registry = registry
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="originchats-storage")
+        # channel name -> lane, only while the channel has jobs queued or running
+        self._lanes = {}
+        # command -> metrics
+        self._metrics = {}
+
+    def _metrics_for(self, cmd):
+        metrics = self._metrics.get(cmd)
+        if metrics is None:
+            if len(self._metrics) >= MAX_TRACKED_COMMANDS:
+                cmd = "other"
+                metrics = self._metrics.get(cmd)
+                if metrics is not None:
+                    return metrics
+            metrics = self._metrics[cmd] = _CommandMetrics()
+        return metrics
+
+    async def run(self, ws, message, server_data):
+        """
+        Handle a client message, running its handler on the worker pool if the command touches storage.
+
+        Returns:
+            The response.
+        """
+        spec, ctx, error = self.registry.check(ws, message, server_data)
+        if spec is None:
+            return error
+        if not spec.offload:
+            start = time.perf_counter()
+            try:
+                return spec.handler(ctx, ws, message, server_data)
+            finally:
+                self._metrics_for(spec.name).record(0.0, time.perf_counter() - start)
+
+        metrics = self._metrics_for(spec.name)
+        metrics.offloaded += 1
+        channel_name = message.get("channel")
+        return await self._submit(channel_name if isinstance(channel_name, str) else None, metrics, spec.handler, ctx, ws, message, server_data)
+
+    async def run_in_channel(self, channel_name, func, *args):
+        """Run a function on the worker pool, serialized with the commands of a channel."""
+        return await self._submit(channel_name, None, func, *args)
+
+    async def _submit(self, channel_name, metrics, func, *args):
+        queued = time.perf_counter()
+        timing = []
+
+        def job():
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                timing.append((start - queued, time.perf_counter() - start))
+
+        try:
+            if channel_name is None:
+                return await self._execute(job)
+            lane = self._lanes.get(channel_name)
+            if lane is None:
+                lane = self._lanes[channel_name] = _Lane()
+            lane.users += 1
+            try:
+                async with lane.lock:
+                    return await self._execute(job)
+            finally:
+                lane.users -= 1
+                if lane.users == 0:
+                    del self._lanes[channel_name]
+        finally:
+            if metrics is not None and timing:
+                metrics.record(*timing[0])
+
+    async def _execute(self, job):
+        future = asyncio.get_running_loop().run_in_executor(self._executor, job)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Keep the channel's lane held until the job has really finished
+            await asyncio.wait([future])
+            raise
+
+    def shutdown(self):
+        """Wait for running jobs to finish and stop the worker threads."""
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        """
+        Get per-command timings in milliseconds.
+
+        Returns:
+            dict: The pool size, busy channels and {cmd: {count, offloaded, wait_avg_ms, wait_max_ms, exec_avg_ms, exec_max_ms}}.
+        """
+        commands = {}
+        for cmd, metrics in self._metrics.items():
+            count = metrics.count or 1
+            commands[cmd] = {
+                "count": metrics.count,
+                "offloaded": metrics.offloaded,
+                "wait_avg_ms": metrics.wait_total / count * 1000,
+                "wait_max_ms": metrics.wait_max * 1000,
+                "exec_avg_ms": metrics.exec_total / count * 1000,
+                "exec_max_ms": metrics.exec_max * 1000
+            }
+        return {
+            "workers": self.workers,
+            "busy_channels": len(self._lanes),
+            "commands": commands
+        }
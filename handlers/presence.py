@@ -0,0 +1,147 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import users, roles
+
+class PresenceRegistry:
+    """
+    Registry of the users that are currently online.
+
+    Each user is reference counted by their authenticated sockets, so a user
+    with several tabs open stays online until the last one disconnects. The
+    display projection of every online user is kept ready, and the online list
+    is only rebuilt when someone comes or goes or user/role data changes.
+
+    In multi-worker mode the users online on the other workers are tracked
+    too, so the online list covers the whole server.
+    """
+
+    def __init__(self):
+        self._sockets = set()
+        # username -> number of authenticated sockets
+        self._counts = {}
+        # worker id -> names of the users online on that worker
+        self._remote = {}
+        # username -> display projection
+        self._projections = {}
+        self._online = None
+        self._version = None
+        # Called with (username, online) when a user's first socket here connects or their last one leaves
+        self.on_change = None
+
+    @staticmethod
+    def _current_version():
+        return (users.get_version(), roles.get_version())
+
+    def _ensure_current(self):
+        version = self._current_version()
+        if self._version != version:
+            self._version = version
+            self._projections.clear()
+            self._online = None
+
+    def connect(self, ws):
+        """
+        Count an authenticated socket towards its user's presence.
+
+        Returns:
+            bool: True if this is the user's first online socket.
+        """
+        if ws in self._sockets:
+            return False
+        self._sockets.add(ws)
+        username = ws.username
+        count = self._counts.get(username, 0)
+        self._counts[username] = count + 1
+        if count == 0:
+            self._online = None
+            if self.on_change is not None:
+                self.on_change(username, True)
+        return count == 0
+
+    def disconnect(self, ws):
+        """
+        Remove a socket from its user's presence.
+
+        Returns:
+            bool: True if the user has no online sockets left.
+        """
+        if ws not in self._sockets:
+            return False
+        self._sockets.discard(ws)
+        username = ws.username
+        count = self._counts.get(username, 0) - 1
+        if count > 0:
+            self._counts[username] = count
+            return False
+        self._counts.pop(username, None)
+        if not self.is_online(username):
+            self._projections.pop(username, None)
+        self._online = None
+        if self.on_change is not None:
+            self.on_change(username, False)
+        return True
+
+    def set_remote(self, worker_id, usernames):
+        """Replace the users online on another worker."""
+        self._remote[worker_id] = set(usernames)
+        self._online = None
+
+    def remote_changed(self, worker_id, username, online):
+        """Record a user coming online on or leaving another worker."""
+        remote = self._remote.setdefault(worker_id, set())
+        if online:
+            remote.add(username)
+        else:
+            remote.discard(username)
+            if not self.is_online(username):
+                self._projections.pop(username, None)
+        self._online = None
+
+    def drop_worker(self, worker_id):
+        """Forget the users of a worker that has gone away."""
+        if self._remote.pop(worker_id, None) is not None:
+            self._online = None
+
+    def _all_usernames(self):
+        usernames = dict.fromkeys(self._counts)
+        for remote in self._remote.values():
+            usernames.update(dict.fromkeys(remote))
+        return usernames
+
+    def is_online(self, username):
+        """Check if a user has at least one authenticated socket on any worker."""
+        return username in self._counts or any(username in remote for remote in self._remote.values())
+
+    def usernames(self):
+        """Get the names of the users online on this worker."""
+        return list(self._counts)
+
+    def online(self):
+        """
+        Get the display projections of all online users, once per user.
+
+        Returns:
+            list: A list of {"username", "roles", "color"} dicts, which must not be modified.
+        """
+        self._ensure_current()
+        if self._online is None:
+            online = []
+            for username in self._all_usernames():
+                projection = self._projections.get(username)
+                if projection is None:
+                    projection = users.get_user_projection(username)
+                    if projection is None:
+                        continue
+                    self._projections[username] = projection
+                online.append(projection)
+            self._online = online
+        return list(self._online)
+
+    def stats(self):
+        """Get the number of online users and sockets."""
+        return {
+            "users": len(self._counts),
+            "users_all_workers": len(self._all_usernames()),
+            "sockets": len(self._sockets)
+        }
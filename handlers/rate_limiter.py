@@ -1,87 +1,429 @@
-import time
-from collections import defaultdict, deque
+import time, sys, math, struct, os
 import threading
 
+# Length of the burst window in seconds
+BURST_WINDOW = 10
+
+# Name of the bucket configured by the top-level rate_limiting settings
+DEFAULT_BUCKET = "messages"
+
+# Extra buckets, so cheap events and expensive reads do not share the message allowance
+DEFAULT_BUCKETS = {
+    "typing": {"messages_per_minute": 60, "burst_limit": 10, "cooldown_seconds": 5},
+    "reactions": {"messages_per_minute": 60, "burst_limit": 10, "cooldown_seconds": 10},
+    "history": {"messages_per_minute": 120, "burst_limit": 20, "cooldown_seconds": 10}
+}
+
+# Bucket and cost of each rate limited command; other commands use the default bucket at cost 1
+DEFAULT_COMMANDS = {
+    "message_new": {"bucket": DEFAULT_BUCKET, "cost": 1},
+    "message_edit": {"bucket": DEFAULT_BUCKET, "cost": 1},
+    "typing": {"bucket": "typing", "cost": 1},
+    "message_react_add": {"bucket": "reactions", "cost": 1},
+    "message_react_remove": {"bucket": "reactions", "cost": 1},
+    "messages_get": {"bucket": "history", "cost": 2},
+    "message_replies": {"bucket": "history", "cost": 1}
+}
+
+# Snapshot layout: header, then one record per user state
+_SNAPSHOT_MAGIC = b"OCRL"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<4sBdI")     # magic, version, saved at, record count
+_SNAPSHOT_RECORD = struct.Struct("<BHdddd")    # bucket name length, user id length, minute tokens, burst tokens, updated, cooldown until
+
+class _Bucket:
+    """Limits of one named bucket"""
+
+    def __init__(self, messages_per_minute, burst_limit, cooldown_seconds):
+        self.messages_per_minute = messages_per_minute
+        self.burst_limit = burst_limit
+        self.cooldown_seconds = cooldown_seconds
+        # Tokens regained per second
+        self.minute_rate = messages_per_minute / 60
+        self.burst_rate = burst_limit / BURST_WINDOW
+
+class _UserBucket:
+    """Rate limiting state of one user in one bucket"""
+    __slots__ = ("minute_tokens", "burst_tokens", "updated", "cooldown_until")
+
+    def __init__(self, minute_tokens, burst_tokens, updated):
+        self.minute_tokens = minute_tokens
+        self.burst_tokens = burst_tokens
+        self.updated = updated
+        self.cooldown_until = 0.0
+
 class RateLimiter:
-    """Thread-safe rate limiter for user messages"""
-    
-    def __init__(self, messages_per_minute=30, burst_limit=5, cooldown_seconds=60):
+    """
+    Rate limiter for user messages, confined to the event loop thread.
+
+    Each user has two token buckets: one holding 'messages_per_minute' tokens
+    refilled over a minute, and one holding 'burst_limit' tokens refilled over
+    BURST_WINDOW seconds. A message takes a token from both, and emptying the
+    burst bucket starts a cooldown. Every check is constant time, and users
+    whose buckets have refilled are evicted periodically.
+
+    Commands can be limited in separate named buckets with their own limits,
+    and can take more than one token per call.
+
+    No locks are taken, so it must only be used from one thread. Use
+    ThreadSafeRateLimiter when plugins check limits from other threads.
+    """
+
+    def __init__(self, messages_per_minute=30, burst_limit=5, cooldown_seconds=60, evict_interval=60,
+                 buckets=None, commands=None):
         self.messages_per_minute = messages_per_minute
         self.burst_limit = burst_limit
         self.cooldown_seconds = cooldown_seconds
-        
-        # Track message timestamps for each user
-        self.user_messages = defaultdict(deque)
-        # Track burst messages for each user
-        self.user_burst_count = defaultdict(int)
-        # Track last burst time for each user
-        self.user_last_burst = defaultdict(float)
-        
-        self.lock = threading.Lock()
-    
-    def is_allowed(self, user_id):
+        self.evict_interval = evict_interval
+
+        self.buckets = {DEFAULT_BUCKET: _Bucket(messages_per_minute, burst_limit, cooldown_seconds)}
+        for bucket_name, limits in {**DEFAULT_BUCKETS, **(buckets or {})}.items():
+            if bucket_name == DEFAULT_BUCKET:
+                continue  # Configured by the top-level settings
+            self.buckets[bucket_name] = _Bucket(
+                limits.get("messages_per_minute", messages_per_minute),
+                limits.get("burst_limit", burst_limit),
+                limits.get("cooldown_seconds", cooldown_seconds)
+            )
+
+        # command -> (bucket name, cost)
+        self.commands = {}
+        for command, weight in {**DEFAULT_COMMANDS, **(commands or {})}.items():
+            self.commands[command] = self._command_limit(command, weight)
+
+        self._default_command = (DEFAULT_BUCKET, 1)
+
+        # Seconds after which an empty bucket is full again
+        self._refill_time = max(60, BURST_WINDOW)
+
+        # Called with (user_id, bucket name, cost) after every allowed check, e.g. to share usage with other workers
+        self.on_consume = None
+
+        # bucket name -> {user_id -> _UserBucket}, only for users that are not at rest
+        self.user_buckets = {bucket_name: {} for bucket_name in self.buckets}
+        self._next_eviction = time.time() + evict_interval
+        self.evicted = 0
+
+    def _command_limit(self, command, weight):
+        bucket_name = weight.get("bucket", DEFAULT_BUCKET)
+        if bucket_name not in self.buckets:
+            raise ValueError(f"Rate limiting command '{command}' uses unknown bucket '{bucket_name}'")
+        bucket = self.buckets[bucket_name]
+        # A command costing more than the bucket holds would never be allowed
+        cost = min(weight.get("cost", 1), bucket.messages_per_minute, bucket.burst_limit)
+        return (bucket_name, cost)
+
+    def add_command(self, command, weight):
+        """
+        Rate limit a command that is not configured yet, e.g. one registered by a plugin.
+        Commands already configured keep their settings.
+
+        Args:
+            command (str): The command name
+            weight (dict): {"bucket", "cost"} the command takes
+        """
+        if command not in self.commands:
+            self.commands[command] = self._command_limit(command, weight)
+
+    def _refill(self, state, bucket, current_time):
+        elapsed = current_time - state.updated
+        if elapsed > 0:
+            state.minute_tokens = min(bucket.messages_per_minute, state.minute_tokens + elapsed * bucket.minute_rate)
+            state.burst_tokens = min(bucket.burst_limit, state.burst_tokens + elapsed * bucket.burst_rate)
+            state.updated = current_time
+
+    def _is_idle(self, state, current_time):
+        return current_time - state.updated >= self._refill_time and state.cooldown_until <= current_time
+
+    def _evict_idle(self, current_time):
+        """Forget users whose buckets are full again, since they are the same as unseen users"""
+        for states in self.user_buckets.values():
+            idle = [user_id for user_id, state in states.items() if self._is_idle(state, current_time)]
+            for user_id in idle:
+                del states[user_id]
+            self.evicted += len(idle)
+        self._next_eviction = current_time + self.evict_interval
+
+    def is_allowed(self, user_id, command=None):
         """
-        Check if a user is allowed to send a message.
+        Check if a user is allowed to send a message, or to run a rate limited command.
         Returns (allowed: bool, reason: str, wait_time: float)
         """
-        with self.lock:
-            current_time = time.time()
-            
-            # Clean old messages (older than 1 minute)
-            user_msgs = self.user_messages[user_id]
-            while user_msgs and current_time - user_msgs[0] > 60:
-                user_msgs.popleft()
-            
-            # Check if user is in cooldown from burst limit
-            last_burst = self.user_last_burst[user_id]
-            if last_burst and current_time - last_burst < self.cooldown_seconds:
-                remaining_cooldown = self.cooldown_seconds - (current_time - last_burst)
-                return False, f"You are in cooldown for {remaining_cooldown:.1f} more seconds", remaining_cooldown
-            
-            # Check messages per minute limit
-            if len(user_msgs) >= self.messages_per_minute:
-                oldest_message_time = user_msgs[0]
-                wait_time = 60 - (current_time - oldest_message_time)
-                return False, f"Rate limit exceeded. Wait {wait_time:.1f} seconds", wait_time
-            
-            # Check burst limit (messages within last 10 seconds)
-            recent_messages = sum(1 for msg_time in user_msgs if current_time - msg_time <= 10)
-            if recent_messages >= self.burst_limit:
-                self.user_last_burst[user_id] = current_time
-                return False, f"Burst limit exceeded. You're in cooldown for {self.cooldown_seconds} seconds", self.cooldown_seconds
-            
-            # User is allowed to send message
-            user_msgs.append(current_time)
+        bucket_name, cost = self.commands.get(command, self._default_command)
+        if cost <= 0:
             return True, "", 0
-    
+        bucket = self.buckets[bucket_name]
+
+        current_time = time.time()
+        if current_time >= self._next_eviction:
+            self._evict_idle(current_time)
+
+        states = self.user_buckets[bucket_name]
+        state = states.get(user_id)
+        if state is None:
+            state = _UserBucket(bucket.messages_per_minute, bucket.burst_limit, current_time)
+            states[user_id] = state
+        else:
+            self._refill(state, bucket, current_time)
+
+        # Check if user is in cooldown from burst limit
+        if state.cooldown_until > current_time:
+            remaining_cooldown = state.cooldown_until - current_time
+            return False, f"You are in cooldown for {remaining_cooldown:.1f} more seconds", remaining_cooldown
+
+        # Check messages per minute limit
+        if state.minute_tokens < cost:
+            wait_time = (cost - state.minute_tokens) / bucket.minute_rate
+            return False, f"Rate limit exceeded. Wait {wait_time:.1f} seconds", wait_time
+
+        # Check burst limit
+        if state.burst_tokens < cost:
+            state.cooldown_until = current_time + bucket.cooldown_seconds
+            return False, f"Burst limit exceeded. You're in cooldown for {bucket.cooldown_seconds} seconds", bucket.cooldown_seconds
+
+        # User is allowed to send message
+        state.minute_tokens -= cost
+        state.burst_tokens -= cost
+        if self.on_consume is not None:
+            self.on_consume(user_id, bucket_name, cost)
+        return True, "", 0
+
+    def consume(self, user_id, command=None):
+        """
+        Take a command's cost from a user's allowance without checking it,
+        for usage that was already allowed elsewhere (e.g. by another worker).
+        """
+        bucket_name, cost = self.commands.get(command, self._default_command)
+        self._consume_bucket(user_id, bucket_name, cost)
+
+    def consume_bucket(self, user_id, bucket_name, cost):
+        """
+        Take 'cost' tokens from a user's allowance in a bucket without checking it.
+        Used for usage reported by other workers, which may know commands this one has not seen yet.
+        """
+        self._consume_bucket(user_id, bucket_name, cost)
+
+    def _consume_bucket(self, user_id, bucket_name, cost):
+        bucket = self.buckets.get(bucket_name)
+        if bucket is None or cost <= 0:
+            return
+        current_time = time.time()
+        states = self.user_buckets[bucket_name]
+        state = states.get(user_id)
+        if state is None:
+            state = _UserBucket(bucket.messages_per_minute, bucket.burst_limit, current_time)
+            states[user_id] = state
+        else:
+            self._refill(state, bucket, current_time)
+        state.minute_tokens = max(0, state.minute_tokens - cost)
+        state.burst_tokens = max(0, state.burst_tokens - cost)
+
     def reset_user(self, user_id):
         """Reset rate limiting for a specific user (admin function)"""
-        with self.lock:
-            self.user_messages[user_id].clear()
-            self.user_burst_count[user_id] = 0
-            self.user_last_burst[user_id] = 0
-    
+        for states in self.user_buckets.values():
+            states.pop(user_id, None)
+
+    def _bucket_status(self, user_id, bucket_name, current_time):
+        bucket = self.buckets[bucket_name]
+        state = self.user_buckets[bucket_name].get(user_id)
+
+        messages_this_minute = 0
+        recent_messages = 0
+        cooldown_remaining = 0
+        if state is not None:
+            self._refill(state, bucket, current_time)
+            # Tokens that have not been regained yet, rounded up to whole messages
+            messages_this_minute = math.ceil(bucket.messages_per_minute - state.minute_tokens)
+            recent_messages = math.ceil(bucket.burst_limit - state.burst_tokens)
+            cooldown_remaining = max(0, state.cooldown_until - current_time)
+
+        return {
+            "messages_this_minute": messages_this_minute,
+            "messages_per_minute_limit": bucket.messages_per_minute,
+            "recent_messages": recent_messages,
+            "burst_limit": bucket.burst_limit,
+            "cooldown_remaining": cooldown_remaining
+        }
+
     def get_user_status(self, user_id):
         """Get current rate limiting status for a user"""
+        current_time = time.time()
+        # The top-level fields describe the message bucket
+        status = self._bucket_status(user_id, DEFAULT_BUCKET, current_time)
+        status["buckets"] = {
+            bucket_name: self._bucket_status(user_id, bucket_name, current_time)
+            for bucket_name in self.buckets if bucket_name != DEFAULT_BUCKET
+        }
+        return status
+
+    def memory_report(self):
+        """Get the number of tracked users and the approximate memory they hold in bytes"""
+        tracked_users = set()
+        tracked_buckets = 0
+        approx_bytes = sys.getsizeof(self.user_buckets)
+        # Every state holds four floats besides the object itself
+        float_size = sys.getsizeof(0.0)
+        for states in self.user_buckets.values():
+            approx_bytes += sys.getsizeof(states)
+            tracked_buckets += len(states)
+            for user_id, state in states.items():
+                if user_id not in tracked_users:
+                    tracked_users.add(user_id)
+                    approx_bytes += sys.getsizeof(user_id)
+                approx_bytes += sys.getsizeof(state) + 4 * float_size
+        return {
+            "tracked_users": len(tracked_users),
+            "tracked_buckets": tracked_buckets,
+            "approx_bytes": approx_bytes,
+            "evicted": self.evicted
+        }
+
+    def dump(self):
+        """
+        Serialize the state of every user that is not at rest.
+
+        Returns:
+            bytes: A compact binary snapshot for restore().
+        """
+        current_time = time.time()
+        records = []
+        for bucket_name, states in self.user_buckets.items():
+            encoded_bucket = bucket_name.encode("utf-8")
+            for user_id, state in states.items():
+                if self._is_idle(state, current_time):
+                    continue
+                encoded_user = str(user_id).encode("utf-8")
+                records.append(_SNAPSHOT_RECORD.pack(
+                    len(encoded_bucket), len(encoded_user),
+                    state.minute_tokens, state.burst_tokens, state.updated, state.cooldown_until
+                ) + encoded_bucket + encoded_user)
+        return _SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, current_time, len(records)) + b"".join(records)
+
+    def restore(self, data):
+        """
+        Load a snapshot made by dump(). Tokens are refilled for the time that
+        passed since it was taken, and states that have fully recovered are skipped.
+
+        Returns:
+            int: The number of user states restored.
+        """
+        magic, version, _, count = _SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+            raise ValueError("Not a rate limiter snapshot")
+
+        current_time = time.time()
+        offset = _SNAPSHOT_HEADER.size
+        restored = 0
+        for _ in range(count):
+            bucket_length, user_length, minute_tokens, burst_tokens, updated, cooldown_until = _SNAPSHOT_RECORD.unpack_from(data, offset)
+            offset += _SNAPSHOT_RECORD.size
+            bucket_name = data[offset:offset + bucket_length].decode("utf-8")
+            offset += bucket_length
+            user_id = data[offset:offset + user_length].decode("utf-8")
+            offset += user_length
+
+            bucket = self.buckets.get(bucket_name)
+            if bucket is None:
+                continue  # Bucket no longer configured
+
+            # Clamp to the current limits, which may be lower than when the snapshot was taken
+            state = _UserBucket(min(minute_tokens, bucket.messages_per_minute), min(burst_tokens, bucket.burst_limit), min(updated, current_time))
+            state.cooldown_until = cooldown_until
+            self._refill(state, bucket, current_time)
+            at_rest = (state.minute_tokens >= bucket.messages_per_minute
+                       and state.burst_tokens >= bucket.burst_limit
+                       and state.cooldown_until <= current_time)
+            if at_rest:
+                continue
+            self.user_buckets[bucket_name][user_id] = state
+            restored += 1
+        return restored
+
+    def save(self, path):
+        """Write a snapshot of the limiter state to a file."""
+        write_state_file(path, self.dump())
+
+    def load(self, path):
+        """
+        Restore the limiter state from a file written by save().
+
+        Returns:
+            int: The number of user states restored, 0 if the file does not exist.
+        """
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        return self.restore(data)
+
+def write_state_file(path, data):
+    """Atomically write a limiter snapshot made by RateLimiter.dump()."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class ThreadSafeRateLimiter(RateLimiter):
+    """Rate limiter that can be shared between threads, at the cost of a lock per check"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+
+    def is_allowed(self, user_id, command=None):
+        with self.lock:
+            return super().is_allowed(user_id, command)
+
+    def add_command(self, command, weight):
+        with self.lock:
+            super().add_command(command, weight)
+
+    def reset_user(self, user_id):
+        with self.lock:
+            super().reset_user(user_id)
+
+    def consume(self, user_id, command=None):
+        with self.lock:
+            super().consume(user_id, command)
+
+    def consume_bucket(self, user_id, bucket_name, cost):
+        with self.lock:
+            super().consume_bucket(user_id, bucket_name, cost)
+
+    def get_user_status(self, user_id):
+        with self.lock:
+            return super().get_user_status(user_id)
+
+    def memory_report(self):
+        with self.lock:
+            return super().memory_report()
+
+    def dump(self):
         with self.lock:
-            current_time = time.time()
-            user_msgs = self.user_messages[user_id]
-            
-            # Clean old messages
-            while user_msgs and current_time - user_msgs[0] > 60:
-                user_msgs.popleft()
-            
-            recent_messages = sum(1 for msg_time in user_msgs if current_time - msg_time <= 10)
-            last_burst = self.user_last_burst[user_id]
-            cooldown_remaining = 0
-            
-            if last_burst and current_time - last_burst < self.cooldown_seconds:
-                cooldown_remaining = self.cooldown_seconds - (current_time - last_burst)
-            
-            return {
-                "messages_this_minute": len(user_msgs),
-                "messages_per_minute_limit": self.messages_per_minute,
-                "recent_messages": recent_messages,
-                "burst_limit": self.burst_limit,
-                "cooldown_remaining": cooldown_remaining
-            }
+            return super().dump()
+
+    def restore(self, data):
+        with self.lock:
+            return super().restore(data)
+
+RATE_LIMITER_MODES = {
+    "loop": RateLimiter,
+    "threaded": ThreadSafeRateLimiter
+}
+
+def create_rate_limiter(mode="loop", **kwargs):
+    """
+    Create a rate limiter for the configured mode.
+
+    Args:
+        mode (str): "loop" for the lock-free limiter used from the event loop only,
+            "threaded" for the locked one.
+
+    Returns:
+        RateLimiter: The new rate limiter.
+    """
+    limiter_class = RATE_LIMITER_MODES.get(mode)
+    if limiter_class is None:
+        raise ValueError(f"Unknown rate limiting mode: {mode}")
+    return limiter_class(**kwargs)
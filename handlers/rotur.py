@@ -0,0 +1,124 @@
+import asyncio, aiohttp, hashlib, time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import Logger
+
+class RoturValidator:
+    """
+    Validates Rotur tokens over a pooled, keep-alive HTTP session.
+
+    At most 'max_concurrent' validations are in flight at once, so a burst of
+    logins queues up here instead of stalling the event loop or flooding Rotur.
+    Outcomes are cached for 'cache_ttl' seconds (rejections for
+    'negative_cache_ttl'), keyed on a hash of the token, and concurrent
+    validations of the same token share a single upstream request.
+    """
+
+    def __init__(self, validate_url, validate_key, max_concurrent=16, timeout=5,
+                 cache_ttl=300, negative_cache_ttl=10, cache_max_entries=10000):
+        self.validate_url = validate_url
+        self.key = "originChats-" + validate_key
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.negative_cache_ttl = negative_cache_ttl
+        self.cache_max_entries = cache_max_entries
+        self._session = None
+        self._semaphore = None
+
+        # token hash -> (valid, expires at)
+        self._results = {}
+        # token hash -> task of the upstream request in flight
+        self._inflight = {}
+
+        # Metrics
+        self.cache_hits = 0
+        self.upstream_calls = 0
+        self.merged = 0
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrent, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._session
+
+    async def validate(self, validator):
+        """
+        Check a validator token with the Rotur service.
+
+        Returns:
+            bool: True if Rotur accepted the token.
+        """
+        token_hash = hashlib.sha256(validator.encode("utf-8")).hexdigest()
+
+        cached = self._results.get(token_hash)
+        if cached is not None:
+            if cached[1] > time.monotonic():
+                self.cache_hits += 1
+                return cached[0]
+            del self._results[token_hash]
+
+        task = self._inflight.get(token_hash)
+        if task is None:
+            task = asyncio.ensure_future(self._validate_upstream(token_hash, validator))
+            self._inflight[token_hash] = task
+            task.add_done_callback(lambda _: self._inflight.pop(token_hash, None))
+        else:
+            self.merged += 1
+
+        # Shield the shared request so one client disconnecting does not cancel it for the others
+        return await asyncio.shield(task)
+
+    async def _validate_upstream(self, token_hash, validator):
+        self.upstream_calls += 1
+        valid = await self._request(validator)
+        if valid is None:
+            return False  # Transport errors are not cached
+
+        ttl = self.cache_ttl if valid else self.negative_cache_ttl
+        if ttl > 0:
+            if len(self._results) >= self.cache_max_entries:
+                self._evict_expired()
+            if len(self._results) < self.cache_max_entries:
+                self._results[token_hash] = (valid, time.monotonic() + ttl)
+        return valid
+
+    async def _request(self, validator):
+        """Ask Rotur about a token. Returns True or False, or None if Rotur could not be reached."""
+        session = self._get_session()
+        async with self._semaphore:
+            try:
+                async with session.get(self.validate_url, params={"key": self.key, "v": validator}) as response:
+                    if response.status != 200:
+                        return False
+                    data = await response.json(content_type=None)
+                    # Anything but {"valid": true} is treated as an invalid token
+                    return isinstance(data, dict) and data.get("valid") is True
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                Logger.error(f"Rotur validation failed: {str(e)}")
+                return None
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for token_hash in [h for h, (_, expires) in self._results.items() if expires <= now]:
+            del self._results[token_hash]
+
+    def stats(self):
+        """Get the validation cache and request counters."""
+        return {
+            "cached": len(self._results),
+            "cache_hits": self.cache_hits,
+            "upstream_calls": self.upstream_calls,
+            "merged": self.merged,
+            "in_flight": len(self._inflight)
+        }
+
+    async def close(self):
+        """Close the pooled HTTP session."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,109 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import users, channels
+
+class ChannelSubscriptions:
+    """
+    Index of the authenticated sockets allowed to view each channel.
+
+    Sockets are added when they authenticate and removed when they disconnect.
+    The whole index is rebuilt lazily whenever channel permissions or user
+    roles have changed, so broadcasts only walk the real recipients.
+    """
+
+    def __init__(self):
+        # ws -> (roles, names of the channels the socket can view)
+        self._sockets = {}
+        # channel name -> set of ws
+        self._channels = {}
+        self._version = None
+
+    @staticmethod
+    def _current_version():
+        return (channels.get_permissions_version(), users.get_roles_version())
+
+    @staticmethod
+    def _resolve(username, visible_cache):
+        """Get the roles and viewable channel names of a user, or None if the user does not exist."""
+        user_data = users.get_user(username)
+        if not user_data:
+            return None
+        user_roles = tuple(user_data.get("roles", []))
+        visible = visible_cache.get(user_roles)
+        if visible is None:
+            visible = frozenset(c.get("name") for c in channels.get_all_channels_for_roles(list(user_roles)))
+            visible_cache[user_roles] = visible
+        return user_roles, visible
+
+    def _index(self, ws, entry):
+        self._sockets[ws] = entry
+        for channel_name in entry[1]:
+            self._channels.setdefault(channel_name, set()).add(ws)
+
+    def _unindex(self, ws):
+        entry = self._sockets.pop(ws, None)
+        if entry is None:
+            return
+        for channel_name in entry[1]:
+            subscribers = self._channels.get(channel_name)
+            if subscribers is not None:
+                subscribers.discard(ws)
+                if not subscribers:
+                    del self._channels[channel_name]
+
+    def _rebuild(self):
+        sockets = list(self._sockets)
+        self._sockets = {}
+        self._channels = {}
+        self._version = self._current_version()
+        resolved = {}
+        visible_cache = {}
+        for ws in sockets:
+            username = ws.username
+            if username not in resolved:
+                resolved[username] = self._resolve(username, visible_cache)
+            entry = resolved[username]
+            self._index(ws, entry if entry is not None else ((), frozenset()))
+
+    def _ensure_current(self):
+        if self._version != self._current_version():
+            self._rebuild()
+
+    def add(self, ws):
+        """Subscribe an authenticated socket to every channel its user can view."""
+        self._ensure_current()
+        self._unindex(ws)
+        entry = self._resolve(ws.username, {})
+        self._index(ws, entry if entry is not None else ((), frozenset()))
+
+    def remove(self, ws):
+        """Unsubscribe a socket from all channels."""
+        self._unindex(ws)
+
+    def recipients(self, channel_name):
+        """
+        Get the sockets allowed to view a channel.
+
+        Returns:
+            list: A snapshot of the subscribed sockets.
+        """
+        self._ensure_current()
+        return list(self._channels.get(channel_name, ()))
+
+    def roles_for(self, ws):
+        """
+        Get the roles a subscribed socket was indexed with.
+
+        Returns:
+            tuple: The roles, or None if the socket is not subscribed.
+        """
+        self._ensure_current()
+        entry = self._sockets.get(ws)
+        return entry[0] if entry is not None else None
+
+    def mark_stale(self):
+        """Force a rebuild on the next lookup."""
+        self._version = None
+
+channel_subscriptions = ChannelSubscriptions()
@@ -1,13 +1,38 @@
-import asyncio, json, websockets
+import json, websockets
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from logger import Logger
+from handlers.subscriptions import channel_subscriptions
 
-async def send_to_client(ws, message):
-    """Send a message to a specific client"""
+# Events a lagging client can miss without losing any state
+EPHEMERAL_COMMANDS = {"typing"}
+
+# In multi-worker mode, called with every broadcast so the other workers can deliver it to their clients
+_relay = None
+
+def set_broadcast_relay(relay):
+    """
+    Set the function that forwards broadcasts to other server processes.
+
+    Args:
+        relay: Called with a dict describing each broadcast, or None to stop relaying.
+    """
+    global _relay
+    _relay = relay
+
+def encode_message(message):
+    """Encode a message once so the same frame can be sent to many clients"""
+    return json.dumps(message)
+
+async def send_encoded(ws, frame, droppable=False):
+    """Send an already encoded frame to a specific client"""
+    outbox = getattr(ws, "outbox", None)
+    if outbox is not None:
+        # Queue for the client's writer task instead of waiting on the socket
+        return outbox.put(frame, droppable)
     try:
-        await ws.send(json.dumps(message))
+        await ws.send(frame)
         return True
     except websockets.exceptions.ConnectionClosed:
         Logger.warning("Connection closed when trying to send message")
@@ -16,89 +41,109 @@ async def send_to_client(ws, message):
         Logger.error(f"Error sending message: {str(e)}")
         return False
 
-async def heartbeat(ws, heartbeat_interval=30):
-    """Send periodic pings to keep the connection alive"""
-    try:
-        while True:
-            await asyncio.sleep(heartbeat_interval)
-            if not await send_to_client(ws, {"cmd": "ping"}):
-                break
-    except asyncio.CancelledError:
-        Logger.info("Heartbeat task cancelled")
-    except Exception as e:
-        Logger.error(f"Heartbeat error: {str(e)}")
+async def send_to_client(ws, message):
+    """Send a message to a specific client"""
+    return await send_encoded(ws, encode_message(message))
 
-async def broadcast_to_all(connected_clients, message):
+async def broadcast_to_all(connected_clients, message, relay=True):
     """Broadcast a message to all connected clients"""
+    return await broadcast_encoded_to_all(connected_clients, encode_message(message), message.get("cmd") in EPHEMERAL_COMMANDS, relay)
+
+async def broadcast_encoded_to_all(connected_clients, frame, droppable=False, relay=True):
+    """Broadcast an already encoded frame to all connected clients"""
+    if relay and _relay is not None:
+        _relay({"type": "broadcast", "frame": frame, "channel": None, "droppable": droppable})
     disconnected = set()
     # Create a copy of the set to avoid "Set changed size during iteration" error
     clients_copy = connected_clients.copy()
     for ws in clients_copy:
-        success = await send_to_client(ws, message)
+        success = await send_encoded(ws, frame, droppable)
         if not success:
             disconnected.add(ws)
     
     # Clean up disconnected clients
     for ws in disconnected:
         connected_clients.discard(ws)  # Use discard instead of remove to avoid KeyError
+        channel_subscriptions.remove(ws)
     
     if disconnected:
         Logger.delete(f"Removed {len(disconnected)} disconnected clients")
     
     return disconnected
 
-async def broadcast_to_channel(connected_clients, message, channel_name):
+async def broadcast_to_channel(connected_clients, message, channel_name, relay=True):
     """Broadcast a message to all connected clients who have access to the specified channel"""
-    from db import users, channels
-    
+    return await broadcast_encoded_to_channel(connected_clients, encode_message(message), channel_name, message.get("cmd") in EPHEMERAL_COMMANDS, relay)
+
+async def broadcast_encoded_to_channel(connected_clients, frame, channel_name, droppable=False, relay=True):
+    """Broadcast an already encoded frame to all connected clients who have access to the specified channel"""
+    if relay and _relay is not None:
+        _relay({"type": "broadcast", "frame": frame, "channel": channel_name, "droppable": droppable})
     disconnected = set()
-    sent_count = 0
-    
-    # Create a copy of the set to avoid "Set changed size during iteration" error
-    clients_copy = connected_clients.copy()
     
-    for ws in clients_copy:
-        # Only send to authenticated users
-        if not getattr(ws, 'authenticated', False):
-            continue
-            
-        username = getattr(ws, 'username', None)
-        if not username:
-            continue
-            
-        # Get user roles
-        user_data = users.get_user(username)
-        if not user_data:
+    # Only the sockets subscribed to the channel can view it
+    for ws in channel_subscriptions.recipients(channel_name):
+        if ws not in connected_clients:
             continue
-            
-        user_roles = user_data.get("roles", [])
-        
-        # Check if user has view permission for this channel
-        if channels.does_user_have_permission(channel_name, user_roles, "view"):
-            success = await send_to_client(ws, message)
+        success = await send_encoded(ws, frame, droppable)
+        if not success:
+            disconnected.add(ws)
+    
+    # Clean up disconnected clients
+    for ws in disconnected:
+        connected_clients.discard(ws)
+        channel_subscriptions.remove(ws)
+    
+    if disconnected:
+        Logger.delete(f"Removed {len(disconnected)} disconnected clients")
+    
+    return disconnected
+
+async def broadcast_per_role_set(connected_clients, render):
+    """
+    Broadcast a message that depends on the recipient's roles to all authenticated clients.
+    'render' is called and its result encoded once per distinct set of roles.
+    """
+    groups = {}
+    for ws in connected_clients.copy():
+        user_roles = channel_subscriptions.roles_for(ws)
+        if user_roles is None:
+            continue  # Not authenticated
+        groups.setdefault(user_roles, []).append(ws)
+    
+    disconnected = set()
+    for user_roles, group in groups.items():
+        frame = encode_message(render(list(user_roles)))
+        for ws in group:
+            success = await send_encoded(ws, frame)
             if not success:
                 disconnected.add(ws)
-            else:
-                sent_count += 1
     
     # Clean up disconnected clients
     for ws in disconnected:
         connected_clients.discard(ws)
+        channel_subscriptions.remove(ws)
     
     if disconnected:
         Logger.delete(f"Removed {len(disconnected)} disconnected clients")
     
     return disconnected
 
-async def disconnect_user(connected_clients, username, reason="User disconnected"):
+async def disconnect_user(connected_clients, username, reason="User disconnected", relay=True):
     """Disconnect a specific user by username"""
+    if relay and _relay is not None:
+        _relay({"type": "disconnect_user", "username": username, "reason": reason})
     disconnected = []
     clients_copy = connected_clients.copy()
+    frame = encode_message({"cmd": "disconnect", "reason": reason})
     
     for ws in clients_copy:
         if hasattr(ws, 'username') and ws.username == username:
             try:
-                await send_to_client(ws, {"cmd": "disconnect", "reason": reason})
+                await send_encoded(ws, frame)
+                outbox = getattr(ws, "outbox", None)
+                if outbox is not None:
+                    await outbox.drain()
                 await ws.close()
                 disconnected.append(ws)
                 Logger.delete(f"Disconnected user {username}: {reason}")
@@ -109,5 +154,6 @@ async def disconnect_user(connected_clients, username, reason="User disconnected
     # Clean up disconnected clients
     for ws in disconnected:
         connected_clients.discard(ws)
+        channel_subscriptions.remove(ws)
     
     return len(disconnected)
@@ -1,11 +1,25 @@
 # A fork of the original OriginChats server by Mist.
 
-import asyncio
+import asyncio, json, os
 from server import OriginChatsServer
+import workers
 from logger import Logger
 
 async def main():
     """Main function to start the OriginChats server"""
+    with open(os.path.join(os.path.dirname(__file__), "config.json"), "r") as f:
+        config = json.load(f)
+    
+    # Several worker processes share the port, coordinated by this process
+    worker_config = config.get("workers", {})
+    worker_count = worker_config.get("count", 1)
+    if worker_count > 1:
+        port = config.get("websocket", {}).get("port", 5613)
+        ipc_path = worker_config.get("ipc_path") or workers.default_ipc_path(port)
+        Logger.info(f"Starting OriginChats server with {worker_count} workers...")
+        await workers.run_workers(worker_count, ipc_path)
+        return
+    
     Logger.info("Initializing OriginChats server...")
     server = OriginChatsServer()
     Logger.success("Server initialized successfully")
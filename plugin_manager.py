@@ -1,8 +1,10 @@
 import os
+import asyncio
 import importlib.util
 import inspect
 from typing import Dict, List, Any, Callable, Optional
 from logger import Logger
+from handlers.commands import command_registry
 
 class PluginManager:
     """Manages loading and execution of plugins"""
@@ -15,8 +17,20 @@ class PluginManager:
             self.plugins_dir = plugins_dir
         self.loaded_plugins = {}
         self.event_handlers = {}
+        # Loop the plugin handlers run on, set once the server is running
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
         self.load_plugins()
     
+    def set_event_loop(self, loop: asyncio.AbstractEventLoop):
+        """Set the server's event loop, so events triggered from other threads are handed to it"""
+        self.loop = loop
+    
+    def _on_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+    
     def load_plugins(self):
         """Discover and load all plugins from the plugins directory"""
         if not os.path.exists(self.plugins_dir):
@@ -63,6 +77,20 @@ class PluginManager:
             'path': plugin_path
         }
         
+        # Register commands
+        if hasattr(module, 'register_commands'):
+            try:
+                with command_registry.owned_by(plugin_name):
+                    module.register_commands(command_registry)
+            except Exception as e:
+                # Drop the commands registered before the failure
+                command_registry.unregister_owner(plugin_name)
+                Logger.error(f"Failed to register commands from plugin '{plugin_name}': {str(e)}")
+            else:
+                for name in command_registry.names():
+                    if command_registry.get(name).owner == plugin_name:
+                        Logger.add(f"Registered command '{name}' from plugin '{plugin_name}'")
+        
         # Register event handlers
         for event in plugin_info['handles']:
             handler_name = f"on_{event}"
@@ -87,7 +115,13 @@ class PluginManager:
     
     def trigger_event(self, event: str, ws, message_data: Dict[str, Any], server_data: Optional[Dict[str, Any]] = None):
         """Trigger an event for all plugins that handle it"""
-        
+        # Handlers expect to run on the event loop, e.g. to schedule broadcasts
+        if self.loop is not None and not self._on_loop_thread():
+            self.loop.call_soon_threadsafe(self._dispatch_event, event, ws, message_data, server_data)
+            return
+        self._dispatch_event(event, ws, message_data, server_data)
+    
+    def _dispatch_event(self, event: str, ws, message_data: Dict[str, Any], server_data: Optional[Dict[str, Any]] = None):
         if event not in self.event_handlers:
             Logger.warning(f"No handlers found for event '{event}'")
             return
@@ -112,7 +146,6 @@ class PluginManager:
                 # Check if handler is async
                 if inspect.iscoroutinefunction(handler):
                     # For async handlers, we need to schedule them
-                    import asyncio
                     try:
                         loop = asyncio.get_event_loop()
                         if len(sig.parameters) == 2:
@@ -156,6 +189,9 @@ class PluginManager:
         for event, handlers in self.event_handlers.items():
             self.event_handlers[event] = [h for h in handlers if h['plugin_name'] != plugin_name]
         
+        # Remove old commands
+        command_registry.unregister_owner(plugin_name)
+        
         # Remove old plugin
         del self.loaded_plugins[plugin_name]
         
@@ -173,6 +209,8 @@ class PluginManager:
         Logger.info("Reloading all plugins...")
         
         # Clear everything
+        for plugin_name in self.loaded_plugins:
+            command_registry.unregister_owner(plugin_name)
         self.loaded_plugins.clear()
         self.event_handlers.clear()
         
@@ -335,7 +335,7 @@ COMMANDS["help"] = show_help
 
 
 def send_message_to_channel(channel, content, server_data):
-    from handlers.websocket_utils import broadcast_to_all
+    from handlers.websocket_utils import encode_message, broadcast_encoded_to_all
     
     message = {
         "user": "OriginChats",
@@ -356,7 +356,7 @@ def send_message_to_channel(channel, content, server_data):
             "global": True
         }
         loop = asyncio.get_event_loop()
-        loop.create_task(broadcast_to_all(server_data["connected_clients"], broadcast_msg))
+        loop.create_task(broadcast_encoded_to_all(server_data["connected_clients"], encode_message(broadcast_msg)))
 
 
 def on_new_message(ws, message_data, server_data=None):
@@ -612,7 +612,9 @@ class DiscordGateway:
                         # Get the updated message and add edit metadata
                         updated_message = channels.get_channel_message(channel_name, originchats_message_id)
                         if updated_message:
-                            # Add edit metadata (we need to manually update since edit_channel_message only updates content)
+                            # Add edit metadata (we need to manually update since edit_channel_message only updates content).
+                            # Work on a copy, the stored message is not ours to change.
+                            updated_message = dict(updated_message)
                             updated_message['edited'] = True
                             updated_message['edited_timestamp'] = time.time()
                             
@@ -818,7 +820,8 @@ async def on_new_message(ws, message_data, server_data=None):
         
         # Use message_obj if it has content, otherwise use direct content
         if message_obj and message_obj.get('content'):
-            final_message = message_obj
+            # Copy it, the same message is being saved and broadcast
+            final_message = dict(message_obj)
         else:
             # Create message object from direct data
             final_message = {
@@ -50,10 +50,10 @@ def send_message_to_channel(channel, content, server_data):
     if server_data and "connected_clients" in server_data:
         message = {"cmd": "message_new", "message": out_msg, "channel": channel, "global": True}
         # Schedule this to run in the event loop
-        from handlers.websocket_utils import broadcast_to_all
+        from handlers.websocket_utils import encode_message, broadcast_encoded_to_all
         try:
             loop = asyncio.get_event_loop()
-            loop.create_task(broadcast_to_all(server_data["connected_clients"], message))
+            loop.create_task(broadcast_encoded_to_all(server_data["connected_clients"], encode_message(message)))
         except Exception as e:
             Logger.error(f"Welcome Plugin: Error broadcasting message: {e}")
 
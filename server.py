@@ -1,38 +1,105 @@
-import asyncio, websockets, json, os
-from handlers.websocket_utils import send_to_client, heartbeat, broadcast_to_all, broadcast_to_channel
+import asyncio, websockets, json, os, struct
+from handlers.websocket_utils import send_to_client, broadcast_to_all, broadcast_to_channel, broadcast_encoded_to_all, broadcast_encoded_to_channel, disconnect_user, set_broadcast_relay
+from handlers.heartbeat import HeartbeatScheduler
 from handlers.auth import handle_authentication
 from handlers import message as message_handler
-from handlers.rate_limiter import RateLimiter
+from handlers.commands import command_registry
+from handlers.rate_limiter import create_rate_limiter, write_state_file
+from handlers.subscriptions import channel_subscriptions
+from handlers.presence import PresenceRegistry
+from handlers.admission import AdmissionController
+from handlers.outbound import OutboundManager
+from handlers.pipeline import CommandPipeline
+from handlers.rotur import RoturValidator
 import watchers
+import workers
+from db import channels, users
 from plugin_manager import PluginManager
 from logger import Logger
 
 class OriginChatsServer:
     """OriginChats WebSocket server"""
     
-    def __init__(self, config_path="config.json"):
+    def __init__(self, config_path="config.json", worker_id=0, worker_count=1, ipc_path=None):
         # Load configuration
         with open(os.path.join(os.path.dirname(__file__), config_path), "r") as f:
             self.config = json.load(f)
         
+        # Multi-worker mode: this process is one of 'worker_count' sharing the port
+        self.worker_id = worker_id
+        self.worker_count = worker_count
+        self.ipc_path = ipc_path
+        self.bus = None
+        
         # Server state
         self.connected_clients = set()
         self.version = self.config["service"]["version"]
-        self.heartbeat_interval = 30
+        heartbeat_config = self.config.get("heartbeat", {})
+        self.heartbeat_interval = heartbeat_config.get("interval", 30)
+        # One task pings every connection, spread over the interval
+        self.heartbeat = HeartbeatScheduler(self.heartbeat_interval, heartbeat_config.get("slots", 30))
         self.main_event_loop = None
         self.file_observer = None
+        self.file_watcher = None
+        
+        # Storage-bound commands run on a thread pool so they do not block the event loop
+        pipeline_config = self.config.get("pipeline", {})
+        if pipeline_config.get("enabled", True):
+            self.pipeline = CommandPipeline(command_registry, workers=pipeline_config.get("workers", 4))
+        else:
+            self.pipeline = None
         
         # Initialize rate limiter if enabled
         rate_config = self.config.get("rate_limiting", {})
         if rate_config.get("enabled", False):
-            self.rate_limiter = RateLimiter(
+            # Limits are checked on the event loop, also for offloaded commands
+            self.rate_limiter = create_rate_limiter(
+                mode=rate_config.get("mode", "loop"),
                 messages_per_minute=rate_config.get("messages_per_minute", 30),
                 burst_limit=rate_config.get("burst_limit", 5),
-                cooldown_seconds=rate_config.get("cooldown_seconds", 60)
+                cooldown_seconds=rate_config.get("cooldown_seconds", 60),
+                buckets=rate_config.get("buckets"),
+                commands=rate_config.get("commands")
             )
         else:
             self.rate_limiter = None
         
+        # Limiter state is snapshotted periodically and on shutdown, so a restart does not hand out fresh allowances
+        state_file = rate_config.get("state_file", "db/rate_limits.bin")
+        self.rate_limit_state_file = os.path.join(os.path.dirname(__file__), state_file) if state_file else None
+        self.rate_limit_snapshot_interval = rate_config.get("snapshot_interval", 60)
+        self.rate_limit_snapshot_task = None
+        
+        # Per-client outbound queues, so one slow consumer cannot stall a broadcast
+        outbound_config = self.config.get("outbound", {})
+        self.outbound = OutboundManager(
+            max_queue=outbound_config.get("max_queue", 1000),
+            drop_ephemeral_at=outbound_config.get("drop_typing_at", 100),
+            slow_consumer_policy=outbound_config.get("slow_consumer", "disconnect")
+        )
+        
+        # Connection limits applied before a client has authenticated
+        admission_config = self.config.get("admission", {})
+        self.admission = AdmissionController(
+            max_per_ip=admission_config.get("max_connections_per_ip", 0),
+            auth_timeout=admission_config.get("auth_timeout", 30),
+            max_pending_auth=admission_config.get("max_pending_auth", 1000)
+        )
+        
+        # Shared Rotur validator with pooled keep-alive connections
+        rotur_config = self.config["rotur"]
+        self.rotur = RoturValidator(
+            rotur_config["validate_url"],
+            rotur_config["validate_key"],
+            max_concurrent=rotur_config.get("max_concurrent_validations", 16),
+            timeout=rotur_config.get("timeout", 5),
+            cache_ttl=rotur_config.get("cache_ttl", 300),
+            negative_cache_ttl=rotur_config.get("negative_cache_ttl", 10)
+        )
+        
+        # Online users, maintained as clients authenticate and disconnect
+        self.presence = PresenceRegistry()
+        
         # Initialize plugin manager
         self.plugin_manager = PluginManager()
         
@@ -42,19 +109,46 @@ class OriginChatsServer:
         else:
             Logger.warning("Rate limiting disabled")
     
+    def get_server_data(self):
+        """Server state passed to handlers and plugins"""
+        return {
+            "connected_clients": self.connected_clients,
+            "config": self.config,
+            "plugin_manager": self.plugin_manager,
+            "rate_limiter": self.rate_limiter,
+            "outbound": self.outbound,
+            "rotur": self.rotur,
+            "presence": self.presence,
+            "admission": self.admission,
+            "heartbeat": self.heartbeat,
+            "pipeline": self.pipeline,
+            "worker_id": self.worker_id,
+            "bus": self.bus,
+            "file_watcher": self.file_watcher
+        }
+    
     async def handle_client(self, websocket):
         """WebSocket connection handler"""
         # Get client info
         headers = websocket.request.headers
         client_ip = headers.get('CF-Connecting-IP') or headers.get('X-Forwarded-For') or websocket.remote_address[0]
+        
+        # Refuse the connection before doing any work for it if the limits are reached
+        refusal = self.admission.admit(websocket, client_ip)
+        if refusal:
+            code, reason = refusal
+            Logger.warning(f"Refused connection from {client_ip}: {reason}")
+            await websocket.close(code=code, reason=reason)
+            return
         Logger.add(f"New connection from {client_ip}")
         
         # Add to connected clients
+        self.outbound.attach(websocket)
         self.connected_clients.add(websocket)
         Logger.info(f"Total connected clients: {len(self.connected_clients)}")
         
-        # Start heartbeat task
-        heartbeat_task = asyncio.create_task(heartbeat(websocket, self.heartbeat_interval))
+        # Ping the connection from the shared heartbeat scheduler
+        self.heartbeat.add(websocket)
         
         try:
             # Send handshake message
@@ -76,16 +170,13 @@ class OriginChatsServer:
                     # Handle authentication
                     if data.get("cmd") == "auth" and not getattr(websocket, "authenticated", False):
                         # Create server data object for authentication
-                        auth_server_data = {
-                            "connected_clients": self.connected_clients,
-                            "config": self.config,
-                            "plugin_manager": self.plugin_manager,
-                            "rate_limiter": self.rate_limiter
-                        }
-                        await handle_authentication(
+                        auth_server_data = self.get_server_data()
+                        authenticated = await handle_authentication(
                             websocket, data, self.config, 
                             self.connected_clients, client_ip, auth_server_data
                         )
+                        if authenticated:
+                            self.admission.authenticated(websocket)
                         continue
 
                     # Require authentication for other commands
@@ -94,15 +185,13 @@ class OriginChatsServer:
                         continue
 
                     # Create server data object for message handler
-                    server_data = {
-                        "connected_clients": self.connected_clients,
-                        "config": self.config,
-                        "plugin_manager": self.plugin_manager,
-                        "rate_limiter": self.rate_limiter
-                    }
+                    server_data = self.get_server_data()
                     
-                    # Handle message
-                    response = message_handler.handle(websocket, data, server_data)
+                    # Handle message, off the event loop if it touches storage
+                    if self.pipeline:
+                        response = await self.pipeline.run(websocket, data, server_data)
+                    else:
+                        response = message_handler.handle(websocket, data, server_data)
                     if not response:
                         Logger.warning(f"No response for message: {data}")
                         continue
@@ -131,12 +220,17 @@ class OriginChatsServer:
             Logger.error(f"Error handling connection: {str(e)}")
         finally:
             # Clean up
-            heartbeat_task.cancel()
+            self.heartbeat.remove(websocket)
+            channel_subscriptions.remove(websocket)
+            # Only announce the user leaving once their last socket on any worker is gone
+            went_offline = self.presence.disconnect(websocket) and not self.presence.is_online(websocket.username)
+            self.admission.release(websocket)
+            self.outbound.detach(websocket)
             if websocket in self.connected_clients:
                 self.connected_clients.remove(websocket)
                 Logger.delete(f"Client {client_ip} removed. {len(self.connected_clients)} clients remaining")
                 
-                if getattr(websocket, "authenticated", False):
+                if went_offline:
                     await broadcast_to_all(self.connected_clients, {
                         "cmd": "user_disconnect",
                         "username": websocket.username
@@ -144,15 +238,148 @@ class OriginChatsServer:
     
     async def broadcast_wrapper(self, message):
         """Wrapper for broadcast_to_all to maintain compatibility with watchers"""
-        await broadcast_to_all(self.connected_clients, message)
+        # Every worker watches the files itself, so watcher broadcasts are not relayed
+        await broadcast_to_all(self.connected_clients, message, relay=False)
+    
+    def publish_presence(self, username, online):
+        """Tell the other workers that a user came online or went offline here"""
+        if self.bus:
+            self.bus.publish({"type": "presence", "username": username, "online": online})
+    
+    async def start_bus(self):
+        """Connect to the other workers and share broadcasts, storage writes, presence and rate limits"""
+        bus = workers.WorkerBus(self.ipc_path, self.worker_id)
+        
+        async def on_broadcast(message):
+            if message["channel"]:
+                await broadcast_encoded_to_channel(self.connected_clients, message["frame"], message["channel"], message["droppable"], relay=False)
+            else:
+                await broadcast_encoded_to_all(self.connected_clients, message["frame"], message["droppable"], relay=False)
+        
+        async def on_disconnect_user(message):
+            await disconnect_user(self.connected_clients, message["username"], message["reason"], relay=False)
+        
+        def on_rate_limit(message):
+            if self.rate_limiter:
+                # The bucket and cost travel with the message, as plugin commands are only known where they ran
+                self.rate_limiter.consume_bucket(message["user"], message["bucket"], message["cost"])
+        
+        def on_rate_limit_reset(message):
+            if self.rate_limiter:
+                self.rate_limiter.reset_user(message["user"])
+        
+        def on_hello(message):
+            # A worker (re)started, so tell it who is online here
+            bus.publish({"type": "presence_sync", "usernames": self.presence.usernames()})
+        
+        # Channels with a sync queued that has not started yet
+        queued_syncs = set()
+        sync_tasks = set()
+        
+        def sync_channel(channel_name):
+            queued_syncs.discard(channel_name)
+            channels.sync_channel(channel_name)
+        
+        def on_sync_done(task):
+            sync_tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                Logger.error(f"Error syncing channel from another worker: {str(task.exception())}")
+        
+        def on_store(message):
+            channel_name = message["channel"]
+            if not self.pipeline:
+                channels.sync_channel(channel_name)
+                return
+            # A queued sync reads everything written before it starts, so one per channel is enough
+            if channel_name in queued_syncs:
+                return
+            queued_syncs.add(channel_name)
+            # Not awaited, so a busy channel does not hold up the bus messages behind it.
+            # The channel's lane keeps the sync in order with this worker's own commands on it.
+            task = asyncio.create_task(self.pipeline.run_in_channel(channel_name, sync_channel, channel_name))
+            sync_tasks.add(task)
+            task.add_done_callback(on_sync_done)
+        
+        bus.on("broadcast", on_broadcast)
+        bus.on("disconnect_user", on_disconnect_user)
+        bus.on("store", on_store)
+        bus.on("rate_limit", on_rate_limit)
+        bus.on("rate_limit_reset", on_rate_limit_reset)
+        bus.on("hello", on_hello)
+        bus.on("presence", lambda message: self.presence.remote_changed(message["worker"], message["username"], message["online"]))
+        bus.on("presence_sync", lambda message: self.presence.set_remote(message["worker"], message["usernames"]))
+        bus.on("worker_gone", lambda message: self.presence.drop_worker(message["worker"]))
+        await bus.connect()
+        self.bus = bus
+        
+        set_broadcast_relay(bus.publish)
+        self.presence.on_change = self.publish_presence
+        channels.add_write_listener(lambda channel_name: bus.publish({"type": "store", "channel": channel_name}))
+        if self.rate_limiter:
+            self.rate_limiter.on_consume = lambda user_id, bucket_name, cost: bus.publish({"type": "rate_limit", "user": user_id, "bucket": bucket_name, "cost": cost})
+        Logger.info(f"Worker {self.worker_id} connected to the worker hub")
+    
+    def load_rate_limits(self):
+        """Restore the rate limiter state saved by a previous run"""
+        if not self.rate_limiter or not self.rate_limit_state_file:
+            return
+        try:
+            restored = self.rate_limiter.load(self.rate_limit_state_file)
+            Logger.info(f"Restored {restored} rate limit states")
+        except (ValueError, struct.error, UnicodeDecodeError) as e:
+            Logger.warning(f"Ignoring unreadable rate limit state: {str(e)}")
+    
+    async def save_rate_limits(self):
+        """Snapshot the rate limiter state, writing it off the event loop"""
+        if not self.rate_limiter or not self.rate_limit_state_file:
+            return
+        data = self.rate_limiter.dump()
+        await asyncio.get_running_loop().run_in_executor(None, write_state_file, self.rate_limit_state_file, data)
+    
+    async def snapshot_rate_limits(self):
+        """Periodically snapshot the rate limiter state"""
+        while True:
+            await asyncio.sleep(self.rate_limit_snapshot_interval)
+            try:
+                await self.save_rate_limits()
+            except Exception as e:
+                Logger.error(f"Error saving rate limit state: {str(e)}")
     
     async def start_server(self):
         """Start the WebSocket server"""
         # Store the main event loop for use in other threads
         self.main_event_loop = asyncio.get_event_loop()
+        self.plugin_manager.set_event_loop(self.main_event_loop)
+
+        # Other workers write to the same channel logs and users.json
+        if self.worker_count > 1:
+            channels.set_shared_storage(True)
+            users.set_shared_storage(True)
+
+        # Warm the channel history cache before accepting clients
+        channels.warm_cache()
+        cache_stats = channels.get_cache_stats()
+        Logger.info(f"Message cache warmed: {cache_stats['messages']} messages across {cache_stats['channels']} channels")
+
+        # Restore rate limits from before the restart, before clients reconnect
+        self.load_rate_limits()
+        # Every worker sees all rate limited actions over the bus, so one of them saving is enough
+        if self.rate_limiter and self.rate_limit_state_file and self.rate_limit_snapshot_interval > 0 and self.worker_id == 0:
+            self.rate_limit_snapshot_task = asyncio.create_task(self.snapshot_rate_limits())
 
         # Setup file watchers for users.json and channels.json
-        self.file_observer = watchers.setup_file_watchers(self.broadcast_wrapper, self.main_event_loop)
+        watcher_config = self.config.get("watcher", {})
+        self.file_observer, self.file_watcher = watchers.setup_file_watchers(
+            self.broadcast_wrapper, self.main_event_loop,
+            debounce=watcher_config.get("debounce", 0.25),
+            max_delay=watcher_config.get("max_delay", 2),
+            connected_clients=self.connected_clients
+        )
+
+        self.heartbeat.start()
+
+        if self.worker_count > 1:
+            await self.start_bus()
 
         # Get port from config or use default
         port = self.config.get("websocket", {}).get("port", 5613)
@@ -160,24 +387,50 @@ class OriginChatsServer:
         
         Logger.info(f"Starting WebSocket server on {host}:{port}")
         
-        # Trigger server_start event for plugins
-        server_data = {
-            "connected_clients": self.connected_clients,
-            "config": self.config,
-            "plugin_manager": self.plugin_manager,
-            "rate_limiter": self.rate_limiter
-        }
-        self.plugin_manager.trigger_event("server_start", None, {}, server_data)
+        # Trigger server_start event for plugins, once for the whole server
+        if self.worker_id == 0:
+            server_data = self.get_server_data()
+            self.plugin_manager.trigger_event("server_start", None, {}, server_data)
+        
+        if self.worker_count > 1:
+            serve = websockets.serve(self.handle_client, sock=workers.create_listening_socket(host, port), ping_interval=None)
+        else:
+            serve = websockets.serve(self.handle_client, host, port, ping_interval=None)
         
         try:
-            async with websockets.serve(self.handle_client, host, port, ping_interval=None):
-                Logger.success(f"WebSocket server running at ws://{host}:{port}")
+            async with serve:
+                if self.worker_count > 1:
+                    Logger.success(f"Worker {self.worker_id} running at ws://{host}:{port}")
+                else:
+                    Logger.success(f"WebSocket server running at ws://{host}:{port}")
                 
                 # Keep the server running
                 await asyncio.Future()
         finally:
+            self.heartbeat.stop()
+            await self.rotur.close()
+            
+            # Save the rate limiter state for the next run
+            if self.rate_limit_snapshot_task:
+                self.rate_limit_snapshot_task.cancel()
+            if self.worker_id == 0:
+                try:
+                    await self.save_rate_limits()
+                except Exception as e:
+                    Logger.error(f"Error saving rate limit state: {str(e)}")
+            
+            if self.bus:
+                set_broadcast_relay(None)
+                await self.bus.close()
+            
+            # Let offloaded commands finish, then write any pending user changes before exiting
+            if self.pipeline:
+                self.pipeline.shutdown()
+            users.flush()
+            
             # Stop file watcher when server stops
             if self.file_observer:
                 self.file_observer.stop()
                 self.file_observer.join()
-                Logger.info("File watcher stopped")
+                watcher_stats = self.file_watcher.stats()
+                Logger.info(f"File watcher stopped: {watcher_stats['processed']} changes processed, {watcher_stats['suppressed']} coalesced")
@@ -146,15 +146,63 @@ def main():
             "enabled": True,
             "messages_per_minute": 60,
             "burst_limit": 10,
-            "cooldown_seconds": 30
+            "cooldown_seconds": 30,
+            "mode": "loop",
+            "state_file": "db/rate_limits.bin",
+            "snapshot_interval": 60,
+            "buckets": {
+                "typing": {"messages_per_minute": 60, "burst_limit": 10, "cooldown_seconds": 5},
+                "reactions": {"messages_per_minute": 60, "burst_limit": 10, "cooldown_seconds": 10},
+                "history": {"messages_per_minute": 120, "burst_limit": 20, "cooldown_seconds": 10}
+            },
+            "commands": {
+                "message_new": {"bucket": "messages", "cost": 1},
+                "message_edit": {"bucket": "messages", "cost": 1},
+                "typing": {"bucket": "typing", "cost": 1},
+                "message_react_add": {"bucket": "reactions", "cost": 1},
+                "message_react_remove": {"bucket": "reactions", "cost": 1},
+                "messages_get": {"bucket": "history", "cost": 2},
+                "message_replies": {"bucket": "history", "cost": 1}
+            }
+        },
+        "pipeline": {
+            "enabled": True,
+            "workers": 4
+        },
+        "heartbeat": {
+            "interval": 30,
+            "slots": 30
+        },
+        "admission": {
+            "max_connections_per_ip": 10,
+            "auth_timeout": 30,
+            "max_pending_auth": 1000
+        },
+        "outbound": {
+            "max_queue": 1000,
+            "drop_typing_at": 100,
+            "slow_consumer": "disconnect"
+        },
+        "watcher": {
+            "debounce": 0.25,
+            "max_delay": 2
+        },
+        "workers": {
+            "count": 1
         },
         "DB": {
             "channels": "db/channels.json",
+            "messages": {
+                "engine": "log",
+                "hot_cache_size": 200
+            },
             "users": {
                 "file": "db/users.json", 
                 "default": {
                     "roles": ["user"]
-                }
+                },
+                "flush_interval": 2,
+                "flush_threshold": 50
             }
         },
         "websocket": {
@@ -163,7 +211,11 @@ def main():
         },
         "rotur": {
             "validate_url": rotur_url,
-            "validate_key": rotur_key
+            "validate_key": rotur_key,
+            "max_concurrent_validations": 16,
+            "timeout": 5,
+            "cache_ttl": 300,
+            "negative_cache_ttl": 10
         },
         "service": {
             "name": "OriginChats",
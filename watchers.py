@@ -1,21 +1,34 @@
-import asyncio
 import json
 import os
+import time
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from db import users, channels, roles
+from handlers.websocket_utils import broadcast_per_role_set
 from logger import Logger
 
 class FileWatcher(FileSystemEventHandler):
     """File system event handler for watching JSON files"""
     
-    def __init__(self, broadcast_func, main_loop):
+    WATCHED_FILES = ('users.json', 'roles.json', 'channels.json')
+    
+    def __init__(self, broadcast_func, main_loop, debounce=0.25, max_delay=2, connected_clients=None):
         self.broadcast_func = broadcast_func
         self.main_loop = main_loop
+        self.connected_clients = connected_clients
+        
+        # A single json.dump fires several events, so changes to a file are
+        # processed once it has been quiet for 'debounce' seconds, but never
+        # later than 'max_delay' seconds after the first pending event
+        self.debounce = debounce
+        self.max_delay = max_delay
+        # filename -> (timer handle, time of the first pending event); only touched on the main loop
+        self._pending = {}
+        self.processed_events = 0
+        self.suppressed_events = 0
         
         # Cache for tracking changes
         self._users_cache = {}
-        self._channels_cache = []
         
         # Initialize caches
         self._load_initial_state()
@@ -24,44 +37,103 @@ class FileWatcher(FileSystemEventHandler):
     def _load_initial_state(self):
         """Load initial state of files to track changes"""
         try:
-            with open(users.users_index, 'r') as f:
-                self._users_cache = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+            self._users_cache = self._user_projections()
+        except Exception:
             self._users_cache = {}
-        
-        try:
-            with open(channels.channels_index, 'r') as f:
-                self._channels_cache = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self._channels_cache = []
+    
+    def on_moved(self, event):
+        # Atomic rewrites (write to a temp file, then rename over the original) arrive as moves
+        if event.is_directory:
+            return
+        self._handle_change(event.dest_path)
     
     def on_modified(self, event):
         if event.is_directory:
             return
+        self._handle_change(event.src_path)
+    
+    def _handle_change(self, path):
+        filename = os.path.basename(path)
+        if filename not in self.WATCHED_FILES:
+            return
+        # Watchdog calls us from its own thread; coalescing happens on the main loop
+        self.main_loop.call_soon_threadsafe(self._schedule, filename)
+    
+    def _schedule(self, filename):
+        """Start or extend the debounce window of a file"""
+        now = time.monotonic()
+        pending = self._pending.get(filename)
+        if pending:
+            handle, first_event = pending
+            handle.cancel()
+            self.suppressed_events += 1
+        else:
+            first_event = now
+        
+        delay = max(0, min(self.debounce, first_event + self.max_delay - now))
+        handle = self.main_loop.call_later(delay, self._process_change, filename)
+        self._pending[filename] = (handle, first_event)
+    
+    def _process_change(self, filename):
+        """Reload a file once its burst of events is over and broadcast the result"""
+        self._pending.pop(filename, None)
+        self.processed_events += 1
+        path = os.path.join(os.path.dirname(users.users_index), filename)
         
-        filename = os.path.basename(event.src_path)
-             # Handle users.json changes
+        # Handle users.json and roles.json changes
         if filename == 'users.json' or filename == 'roles.json':
-            Logger.edit(f"Users file changed: {event.src_path}")
-            asyncio.run_coroutine_threadsafe(
-                self._handle_users_change(), 
-                self.main_loop
-            )
+            Logger.edit(f"Users file changed: {path}")
+            if filename == 'users.json':
+                users.reload()
+            else:
+                roles.invalidate()
+            self.main_loop.create_task(self._handle_users_change())
         
         # Handle channels.json changes
         elif filename == 'channels.json':
-            Logger.edit(f"Channels file changed: {event.src_path}")
-            asyncio.run_coroutine_threadsafe(
-                self._handle_channels_change(),
-                self.main_loop
-            )
+            Logger.edit(f"Channels file changed: {path}")
+            channels.invalidate_permissions()
+            self.main_loop.create_task(self._handle_channels_change())
+    
+    def stats(self):
+        """Get the number of processed and coalesced change events"""
+        return {
+            "processed": self.processed_events,
+            "suppressed": self.suppressed_events,
+            "pending": len(self._pending)
+        }
+    
+    @staticmethod
+    def _user_projections():
+        """Get the listed users' display projections keyed by username"""
+        return {user["username"]: user for user in users.get_users()}
+    
+    def _diff_users(self, new_users):
+        """Diff the listed users against the cache and return a users_delta packet, or None if nothing changed"""
+        old_users = self._users_cache
+        added = [user for username, user in new_users.items() if username not in old_users]
+        removed = [username for username in old_users if username not in new_users]
+        changed = [
+            user for username, user in new_users.items()
+            if username in old_users and old_users[username] != user
+        ]
+        self._users_cache = new_users
+        
+        if not (added or removed or changed):
+            return None
+        return {
+            "cmd": "users_delta",
+            "added": added,
+            "removed": removed,
+            "changed": changed
+        }
     
     async def _handle_users_change(self):
         try:
-            await self.broadcast_func({
-                "cmd": "users_list",
-                "users": users.get_users()
-            })
+            # Only send what changed; clients ask for the full list with users_list
+            delta = self._diff_users(self._user_projections())
+            if delta:
+                await self.broadcast_func(delta)
             
         except Exception as e:
             Logger.error(f"Error handling users.json change: {e}")
@@ -69,26 +141,38 @@ class FileWatcher(FileSystemEventHandler):
     async def _handle_channels_change(self):
         """Handle channels.json file changes"""
         try:
-            # Load new channels data
-            with open(channels.channels_index, 'r') as f:
-                new_channels = json.load(f)
+            if self.connected_clients is None:
+                # No access to the clients' roles, so everyone gets the raw file
+                with open(channels.channels_index, 'r') as f:
+                    new_channels = json.load(f)
+                await self.broadcast_func({
+                    "cmd": "channels_get",
+                    "val": new_channels
+                })
+                return
             
-            await self.broadcast_func({
+            # Each client gets the channels its roles can view, filtered and encoded once per role set
+            await broadcast_per_role_set(self.connected_clients, lambda user_roles: {
                 "cmd": "channels_get",
-                "val": new_channels
+                "val": channels.get_all_channels_for_roles(user_roles)
             })
             
         except Exception as e:
             Logger.error(f"Error handling channels.json change: {e}")
 
-def setup_file_watchers(broadcast_func, main_loop):
-    """Setup file watchers for users.json and channels.json"""
+def setup_file_watchers(broadcast_func, main_loop, debounce=0.25, max_delay=2, connected_clients=None):
+    """
+    Setup file watchers for users.json and channels.json.
+
+    Returns:
+        tuple: The running Observer, and the FileWatcher whose stats() show the processed and coalesced events.
+    """
     
     # Get the database directory
     db_dir = os.path.dirname(users.users_index)
     
     # Create event handler
-    event_handler = FileWatcher(broadcast_func, main_loop)
+    event_handler = FileWatcher(broadcast_func, main_loop, debounce, max_delay, connected_clients)
     
     # Create observer
     observer = Observer()
@@ -98,4 +182,4 @@ def setup_file_watchers(broadcast_func, main_loop):
     observer.start()
     Logger.success(f"File watcher started for directory: {db_dir}")
     
-    return observer
+    return observer, event_handler
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import tempfile
+import threading
+import multiprocessing
+from logger import Logger
+
+def default_ipc_path(port):
+    """Get the default path of the IPC hub socket for a server port"""
+    return os.path.join(tempfile.gettempdir(), f"originchats-{port}.sock")
+
+def create_listening_socket(host, port):
+    """Create a listening socket that several worker processes can bind to the same port"""
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise OSError("SO_REUSEPORT is not supported on this platform, run a single worker instead")
+    info = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)[0]
+    sock = socket.socket(info[0], socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # The kernel spreads new connections over every worker bound to the port
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(info[4])
+    sock.listen(socket.SOMAXCONN)
+    sock.setblocking(False)
+    return sock
+
+class WorkerBus:
+    """
+    A worker's connection to the IPC hub.
+
+    Messages are JSON objects with a "type", sent one per line. Everything a
+    worker publishes is delivered to every other worker, in order, and passed
+    to the handler registered there for its type.
+    """
+
+    def __init__(self, path, worker_id):
+        self.path = path
+        self.worker_id = worker_id
+        self._handlers = {}
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._loop = None
+        self._loop_thread = None
+
+        # Metrics
+        self.sent = 0
+        self.received = 0
+
+    def on(self, message_type, handler):
+        """Register the handler for a message type. Handlers may be plain functions or coroutines."""
+        self._handlers[message_type] = handler
+
+    async def connect(self, timeout=10):
+        """Connect to the hub, waiting for it to come up, and start reading messages."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        deadline = self._loop.time() + timeout
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if self._loop.time() >= deadline:
+                    raise
+                await asyncio.sleep(0.1)
+        self.publish({"type": "hello"})
+        self._reader_task = asyncio.create_task(self._read())
+
+    def publish(self, message):
+        """Send a message to every other worker. Safe to call from any thread."""
+        if self._writer is None:
+            return
+        message["worker"] = self.worker_id
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        self.sent += 1
+        if threading.get_ident() == self._loop_thread:
+            self._writer.write(data)
+        else:
+            self._loop.call_soon_threadsafe(self._writer.write, data)
+
+    async def _read(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    Logger.error("Lost connection to the worker hub")
+                    break
+                self.received += 1
+                try:
+                    message = json.loads(line)
+                    handler = self._handlers.get(message.get("type"))
+                    if handler is None:
+                        continue
+                    result = handler(message)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as e:
+                    Logger.error(f"Error handling worker bus message: {str(e)}")
+        except asyncio.CancelledError:
+            pass
+
+    async def close(self):
+        """Disconnect from the hub."""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def stats(self):
+        """Get the message counters."""
+        return {
+            "worker": self.worker_id,
+            "sent": self.sent,
+            "received": self.received
+        }
+
+class BusHub:
+    """Relays messages between the worker processes over a Unix socket"""
+
+    def __init__(self, path):
+        self.path = path
+        self._server = None
+        # writer -> worker id
+        self._workers = {}
+        self._tasks = set()
+
+    async def start(self):
+        """Start listening for workers."""
+        try:
+            os.remove(self.path)  # Left over from a previous run
+        except FileNotFoundError:
+            pass
+        self._server = await asyncio.start_unix_server(self._handle_worker, self.path)
+
+    def _relay(self, sender, data):
+        for writer in self._workers:
+            if writer is not sender:
+                writer.write(data)
+
+    async def _handle_worker(self, reader, writer):
+        worker_id = None
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if worker_id is None:
+                    worker_id = json.loads(line).get("worker")
+                    self._workers[writer] = worker_id
+                    Logger.info(f"Worker {worker_id} joined the hub")
+                self._relay(writer, line)
+        except (ConnectionError, ValueError) as e:
+            Logger.error(f"Worker {worker_id} hub connection failed: {str(e)}")
+        finally:
+            self._tasks.discard(task)
+            self._workers.pop(writer, None)
+            writer.close()
+            if worker_id is not None:
+                # Let the others forget the presence of the worker that went away
+                self._relay(None, (json.dumps({"type": "worker_gone", "worker": worker_id}) + "\n").encode("utf-8"))
+
+    async def close(self):
+        """Stop the hub."""
+        if self._server is not None:
+            self._server.close()
+        for writer in list(self._workers):
+            writer.close()
+        # Closing the connections ends their handlers
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def _run_worker(worker_id, worker_count, ipc_path):
+    """Entry point of a worker process"""
+    from server import OriginChatsServer
+    # SIGINT is how the parent stops a worker, even if the parent was started with it ignored
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        server = OriginChatsServer(worker_id=worker_id, worker_count=worker_count, ipc_path=ipc_path)
+        asyncio.run(server.start_server())
+    except KeyboardInterrupt:
+        pass
+
+async def run_workers(worker_count, ipc_path):
+    """
+    Run the IPC hub and 'worker_count' server processes sharing the listening port,
+    restarting workers that die, until the server is stopped.
+    """
+    from db import channels
+
+    if not channels.get_message_store().supports_shared:
+        raise ValueError("Multiple workers need the 'log' message storage engine")
+
+    # Workers hold offsets into the channel logs, so logs are only compacted before they start
+    compacted = channels.compact_channels()
+    if compacted:
+        Logger.info(f"Compacted {compacted} channel logs")
+
+    hub = BusHub(ipc_path)
+    await hub.start()
+    Logger.success(f"Worker hub listening on {ipc_path}")
+
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+
+    def spawn(worker_id):
+        process = context.Process(target=_run_worker, args=(worker_id, worker_count, ipc_path), name=f"originchats-worker-{worker_id}")
+        process.start()
+        processes[worker_id] = process
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    # On Ctrl+C the terminal signals the workers too, so they only need a signal from here on SIGTERM
+    forward_stop = False
+    try:
+        for worker_id in range(worker_count):
+            spawn(worker_id)
+        Logger.success(f"Started {worker_count} workers")
+
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+            if stop.is_set():
+                break
+            for worker_id, process in list(processes.items()):
+                if not process.is_alive():
+                    Logger.error(f"Worker {worker_id} exited with code {process.exitcode}, restarting it")
+                    spawn(worker_id)
+        forward_stop = True
+    finally:
+        for process in processes.values():
+            if forward_stop and process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+        for process in processes.values():
+            # Give workers time to flush users and save rate limits
+            await loop.run_in_executor(None, process.join, 15)
+            if process.is_alive():
+                process.terminate()
+        await hub.close()
+        Logger.info("All workers stopped")